@@ -0,0 +1,257 @@
+"""
+pymysql-level stand-in for a MySQL server.
+
+FakeServer answers the statements crptoolkit sends from a synthetic
+information_schema and a scripted status-counter timeline, sleeping a
+configurable latency per round-trip. install() swaps it in for
+pymysql.connect() so the tools run unmodified.
+"""
+
+import re
+from itertools import islice
+from time import sleep
+import pymysql
+import pymysql.converters
+import pymysql.cursors
+
+class Clock:
+    """
+    Virtual clock so scripted timelines (and the tools' sleeps) do not cost wall time.
+    """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += max(0, seconds)
+
+class SyntheticCatalog:
+    """
+    Generates information_schema rows for {tables} tables spread over schemas of {per_schema} tables.
+    Every table has an int primary key and {columns} latin1 string columns, every 10th table an
+    oversized indexed VARCHAR(1024) and every 20th table a foreign key to the previous table.
+    Tables numbered in {altered} report a later CREATE_TIME, as if they were rebuilt.
+    """
+
+    def __init__(self, tables, columns = 8, per_schema = 100):
+        self.tables = tables
+        self.columns = columns
+        self.per_schema = per_schema
+        self.altered = set()
+
+    def names(self):
+        for number in range(self.tables):
+            yield f"db{number // self.per_schema}", f"t{number}", number
+
+    def collations(self):
+        yield ("latin1_swedish_ci", "latin1")
+        yield ("utf8mb4_0900_ai_ci", "utf8mb4")
+        yield ("utf8mb4_general_ci", "utf8mb4")
+
+    def schemata(self):
+        for schema in range((self.tables + self.per_schema - 1) // self.per_schema):
+            yield (f"db{schema}", "latin1", "latin1_swedish_ci")
+
+    def table_rows(self):
+        for schema, table, number in self.names():
+            yield (schema, table, "latin1_swedish_ci", (number % 50) * 64 * 1048576, 1700000000 + (86400 if number in self.altered else 0))
+
+    def column_rows(self):
+        for schema, table, number in self.names():
+            for column in range(self.columns):
+                yield (schema, table, f"c{column}", "varchar", 1024 if column == 0 and number % 10 == 0 else 255, "latin1")
+
+    def statistics_rows(self):
+        for schema, table, number in self.names():
+            yield (schema, table, "id", "PRIMARY", "BTREE", None)
+            if number % 10 == 0:
+                yield (schema, table, "c0", "ix_c0", "BTREE", None)
+
+    def foreign_key_rows(self):
+        for schema, table, number in self.names():
+            if number % 20 == 1:
+                yield (schema, table, "c1", schema, f"t{number - 1}", "c1")
+
+    SOURCES = {
+            "collation_character_set_applicability": "collations",
+            "schemata": "schemata",
+            "tables": "table_rows",
+            "columns": "column_rows",
+            "statistics": "statistics_rows",
+            "key_column_usage": "foreign_key_rows"
+            }
+
+class StatusTimeline:
+    """
+    Status counters as functions of (virtual) seconds since the timeline started.
+    """
+
+    def __init__(self, clock, counters):
+        self.clock = clock
+        self.counters = counters
+        self.start = clock.monotonic()
+
+    def value(self, name):
+        if (counter := self.counters.get(name)) is None:
+            return None
+        return str(int(counter(self.clock.monotonic() - self.start)))
+
+def draining_dirty_pages(pages, flush_rate, write_rate = 0):
+    """
+    Timeline counters for a buffer pool flushing {flush_rate} pages/s while {write_rate} pages/s are dirtied
+    Returns dictionary for StatusTimeline
+    """
+    return {
+            "Innodb_buffer_pool_pages_dirty": lambda t: max(0, pages - (flush_rate - write_rate) * t),
+            "Innodb_buffer_pool_pages_flushed": lambda t: flush_rate * t,
+            "Threads_running": lambda t: 2
+            }
+
+def shutdown_backlog(history, purge_rate, ibuf_pages, merge_rate, commit_rate = 0):
+    """
+    Timeline counters for an undo history list purged at {purge_rate} while {commit_rate}
+    transactions/s add to it, and a change buffer draining at a steady rate
+    Returns dictionary for StatusTimeline
+    """
+    return {
+            "trx_rseg_history_len": lambda t: max(0, history - (purge_rate - commit_rate) * t),
+            "trx_commits_insert_update": lambda t: commit_rate * t,
+            "purge_undolog_pages": lambda t: purge_rate * min(t, history / max(purge_rate - commit_rate, 1e-9)),
+            "ibuf_size": lambda t: max(0, ibuf_pages - merge_rate * t),
+            "ibuf_merges": lambda t: merge_rate * min(t, ibuf_pages / merge_rate),
+            "log_lsn_checkpoint_age": lambda t: 50000000,
+            "active_transactions": lambda t: 1
+            }
+
+class FakeServer:
+    """
+    Routes statements to synthetic result sets and counts round-trips.
+    """
+
+    VARIABLES = {
+            "character_set_server": "latin1",
+            "character_set_database": "latin1",
+            "character_set_client": "utf8mb4",
+            "character_set_connection": "utf8mb4",
+            "character_set_results": "utf8mb4",
+            "collation_server": "latin1_swedish_ci",
+            "collation_database": "latin1_swedish_ci",
+            "collation_connection": "utf8mb4_0900_ai_ci",
+            "default_collation_for_utf8mb4": "utf8mb4_0900_ai_ci",
+            "innodb_max_dirty_pages_pct": "90.000000",
+            "innodb_buffer_pool_load_at_startup": "ON",
+            "slave_parallel_workers": "0",
+            "gtid_mode": "OFF",
+            "server_uuid": "00000000-0000-0000-0000-000000000001"
+            }
+
+    def __init__(self, catalog = None, timeline = None, latency = 0.0, clock = None):
+        self.catalog = catalog if catalog is not None else SyntheticCatalog(0)
+        self.timeline = timeline
+        self.latency = latency
+        self.clock = clock
+        self.variables = dict(self.VARIABLES)
+        self.round_trips = 0
+        self.connections = 0
+        self.statements = {}
+
+    def wait(self):
+        self.round_trips += 1
+        if self.latency:
+            sleep(self.latency)
+
+    def execute(self, sql):
+        """
+        Returns (column names, row iterator)
+        """
+        self.wait()
+        verb = sql.split(None, 1)[0].upper()
+        self.statements[verb] = self.statements.get(verb, 0) + 1
+        if (match := re.search(r"FROM information_schema\.(\w+)", sql)) and match.group(1) in self.catalog.SOURCES:
+            if "WHERE character_set_name=" in sql:
+                return ["1"], iter([(1,)])
+            rows = getattr(self.catalog, self.catalog.SOURCES[match.group(1)])()
+            # Incremental catalog refreshes filter on (table_schema = 'x' AND table_name IN (...))
+            if (conditions := re.findall(r"table_schema = '([^']+)' AND table_name IN \(([^)]*)\)", sql)):
+                only = {(schema, table) for schema, tables in conditions for table in re.findall(r"'([^']+)'", tables)}
+                rows = (row for row in rows if (row[0], row[1]) in only)
+            return None, rows
+        if "information_schema.innodb_metrics" in sql:
+            # Shutdown readiness reads every signal in one UNION of (name, value) rows
+            names = re.findall(r"'(\w+)'", sql)
+            values = ((name, None if self.timeline is None else self.timeline.value(name)) for name in names)
+            return ["name", "value"], iter([(name, value) for name, value in values if value is not None])
+        if (match := re.search(r"FROM performance_schema\.(global_variables|global_status) WHERE VARIABLE_NAME IN \((.*)\)", sql)):
+            names = re.findall(r"'([^']+)'", match.group(2))
+            if match.group(1) == "global_variables":
+                values = ((name, self.variables.get(name)) for name in names)
+            else:
+                values = ((name, None if self.timeline is None else self.timeline.value(name)) for name in names)
+            return ["VARIABLE_NAME", "VARIABLE_VALUE"], iter([(name, value) for name, value in values if value is not None])
+        if (match := re.match(r"SET GLOBAL (\w+) = (.*)", sql)):
+            self.variables[match.group(1)] = match.group(2).strip("'\"")
+        return [], iter(())
+
+class FakeCursor:
+
+    def __init__(self, server, cursorclass):
+        self.server = server
+        self.dictionary = issubclass(cursorclass, pymysql.cursors.DictCursorMixin)
+        self.columns = []
+        self.rows = iter(())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.rows = iter(())
+
+    def execute(self, sql):
+        columns, rows = self.server.execute(sql)
+        self.columns = columns
+        self.rows = rows
+        return 0
+
+    def format(self, row):
+        if not self.dictionary:
+            return tuple(row)
+        columns = self.columns if self.columns is not None else [str(number) for number in range(len(row))]
+        return dict(zip(columns, row))
+
+    def fetchmany(self, size = 1):
+        return [self.format(row) for row in islice(self.rows, size)]
+
+    def fetchall(self):
+        return [self.format(row) for row in self.rows]
+
+    def fetchone(self):
+        rows = self.fetchmany(1)
+        return rows[0] if rows else None
+
+class FakeConnection:
+
+    def __init__(self, server):
+        self.server = server
+        server.connections += 1
+        server.wait()
+
+    def cursor(self, cursorclass = pymysql.cursors.Cursor):
+        return FakeCursor(self.server, cursorclass)
+
+    def close(self):
+        pass
+
+    def escape(self, value):
+        return "'" + pymysql.converters.escape_string(value) + "'"
+
+def install(server):
+    """
+    Makes pymysql.connect() return connections to {server}
+    """
+    pymysql.connect = lambda *args, **kwargs: FakeConnection(server)
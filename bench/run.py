@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+"""
+Benchmarks the crptoolkit flows against bench/fake.py.
+
+Every (scenario, tables, latency) combination runs in its own subprocess so
+peak RSS is measured per scenario. Reports wall time, round-trips and peak RSS.
+
+    python bench/run.py
+    python bench/run.py --scenario preflight ddl --tables 1000 10000 --latency-ms 0 5
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+from os.path import abspath, dirname, join
+from time import perf_counter
+
+ROOT = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, dirname(abspath(__file__)))
+
+SCENARIOS = ["run_query", "stream_query", "preflight", "parallel", "ddl", "cached", "shutdown", "readiness", "startup"]
+# Cold start budget for one `crp <command> --help` process, interpreter start included
+STARTUP_BUDGET = 0.15
+# Parsing a command line must not import these, the command's implementation pulls them in when it runs
+STARTUP_LAZY = ["pymysql", "prettytable", "configparser", "getpass"]
+
+def args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenario", nargs="+", dest="scenarios", default=SCENARIOS, choices=SCENARIOS, help="Scenarios to run (default: all)")
+    parser.add_argument("--tables", nargs="+", type=int, dest="tables", default=[1000, 10000, 100000], help="Synthetic catalog sizes (default: 1000 10000 100000)")
+    parser.add_argument("--latency-ms", nargs="+", type=float, dest="latencies", default=[0.0], help="Per round-trip latency in milliseconds (default: 0)")
+    parser.add_argument("--json", action="store_true", dest="json", help="Print results as JSON lines")
+    parser.add_argument("--child", nargs=3, dest="child", metavar=("SCENARIO", "TABLES", "LATENCY_MS"), help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+def crp(*argv):
+    from crptoolkit.cli import main
+    main(list(argv))
+
+def scenario_run_query(server):
+    from crptoolkit.mysql import MySQL
+    mysql = MySQL(None, "127.0.0.1", 3306, None, None, None)
+    mysql.connect()
+    mysql.run_query("SELECT * FROM information_schema.columns")
+
+def scenario_stream_query(server):
+    from crptoolkit.mysql import MySQL
+    mysql = MySQL(None, "127.0.0.1", 3306, None, None, None)
+    mysql.connect()
+    for row in mysql.stream_query("SELECT * FROM information_schema.columns"):
+        pass
+
+def scenario_preflight(server):
+    crp("charset-converter", "--no-ddl")
+
+def scenario_parallel(server):
+    crp("charset-converter", "--no-ddl", "--parallel", "6")
+
+def scenario_ddl(server):
+    crp("charset-converter", "--no-preflight")
+
+def prepare_cached(server):
+    crp("charset-converter", "--no-preflight", "--no-ddl", "--catalog-cache", server.cache)
+    # 1% of the tables were rebuilt since the snapshot
+    server.catalog.altered = set(range(0, server.catalog.tables, 100))
+    server.round_trips = server.connections = 0
+
+def scenario_cached(server):
+    crp("charset-converter", "--catalog-cache", server.cache)
+
+def scenario_shutdown(server):
+    import crptoolkit.flush
+    import crptoolkit.mysql
+    # Tool sleeps advance the virtual clock that drives the dirty page timeline
+    for module in (crptoolkit.flush, crptoolkit.mysql):
+        module.monotonic = server.clock.monotonic
+        module.sleep = server.clock.sleep
+    crp("prepare-shutdown", "--no-transaction-check")
+
+def scenario_readiness(server):
+    import crptoolkit.flush
+    import crptoolkit.mysql
+    import crptoolkit.readiness
+    for module in (crptoolkit.flush, crptoolkit.mysql, crptoolkit.readiness):
+        module.monotonic = server.clock.monotonic
+        module.sleep = server.clock.sleep
+    crp("prepare-shutdown", "--no-transaction-check", "--shutdown-budget", "30")
+
+def scenario_startup(server):
+    from crptoolkit.cli import COMMANDS
+    for command in [[]] + [[name] for name in COMMANDS]:
+        start = perf_counter()
+        process = subprocess.run([sys.executable, "-X", "importtime", "-m", "crptoolkit.cli", *command, "--help"], cwd=ROOT, capture_output=True, text=True)
+        seconds = perf_counter() - start
+        imported = {line.rsplit("|", 1)[-1].strip() for line in process.stderr.splitlines()}
+        invocation = " ".join(["crp", *command, "--help"])
+        if (eager := [module for module in STARTUP_LAZY if module in imported]):
+            sys.exit(f"{invocation} imported {', '.join(eager)}")
+        if seconds > STARTUP_BUDGET:
+            sys.exit(f"{invocation} took {seconds:.3f}s, over the {STARTUP_BUDGET}s budget")
+
+def child(scenario, tables, latency_ms):
+    from fake import Clock, FakeServer, StatusTimeline, SyntheticCatalog, draining_dirty_pages, install, shutdown_backlog
+    clock = Clock()
+    timeline = StatusTimeline(clock, {**draining_dirty_pages(pages=tables * 10, flush_rate=2000, write_rate=200), **shutdown_backlog(history=tables * 50, purge_rate=5000, ibuf_pages=tables, merge_rate=100, commit_rate=1000)})
+    server = FakeServer(SyntheticCatalog(tables), timeline, latency_ms / 1000, clock)
+    install(server)
+    with tempfile.TemporaryDirectory() as directory, open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        server.cache = join(directory, "catalog.json.gz")
+        if (prepare := globals().get(f"prepare_{scenario}")) is not None:
+            prepare(server)
+        start = perf_counter()
+        globals()[f"scenario_{scenario}"](server)
+        wall = perf_counter() - start
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps({
+        "scenario": scenario,
+        "tables": tables,
+        "latency_ms": latency_ms,
+        "wall_seconds": round(wall, 3),
+        "virtual_seconds": round(clock.monotonic(), 1),
+        "round_trips": server.round_trips,
+        "connections": server.connections,
+        "peak_rss_mb": round(peak_rss_mb, 1)
+        }))
+
+def main():
+    options = args()
+    if options.child:
+        scenario, tables, latency_ms = options.child
+        child(scenario, int(tables), float(latency_ms))
+        return
+    results = []
+    for scenario in options.scenarios:
+        for tables in options.tables:
+            for latency_ms in options.latencies:
+                command = [sys.executable, abspath(__file__), "--child", scenario, str(tables), str(latency_ms)]
+                process = subprocess.run(command, capture_output=True, text=True)
+                if process.returncode != 0:
+                    sys.exit(f"{scenario} ({tables} tables, {latency_ms} ms): {process.stderr.strip()}")
+                result = json.loads(process.stdout.strip().splitlines()[-1])
+                results.append(result)
+                if options.json:
+                    print(json.dumps(result), flush=True)
+    if options.json:
+        return
+    from prettytable import PrettyTable
+    table = PrettyTable(list(results[0].keys()))
+    table.align = "r"
+    for result in results:
+        table.add_row(list(result.values()))
+    print(table)
+
+if __name__ == "__main__":
+    main()
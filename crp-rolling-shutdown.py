@@ -0,0 +1,7 @@
+#!/usr/bin/env python
+
+import sys
+from crptoolkit.cli import main
+
+if __name__ == "__main__":
+    main(["rolling-shutdown"] + sys.argv[1:])
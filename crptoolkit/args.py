@@ -1,6 +1,17 @@
-import configparser
-import getpass
-from os.path import os, expanduser, exists
+from os.path import expanduser, exists
+
+def add_connection_args(parser):
+    """
+    Adds the MySQL connection options every tool shares
+    """
+    parser.add_argument("-u", "--user", type=str, dest="user", help="MySQL user")
+    parser.add_argument("-p", "--password", type=str, dest="password", metavar="PASS", help="MySQL password")
+    parser.add_argument("--ask-pass", dest="ask_pass", action="store_true", help="Ask for password")
+    parser.add_argument("-H", "--host", type=str, dest="host", help="MySQL host (default: 127.0.0.1)")
+    parser.add_argument("-P", "--port", type=int, dest="port", help="MySQL port (default: 3306)")
+    parser.add_argument("-S", "--socket", type=str, dest="socket", metavar="SOCK",
+                        help="MySQL socket")
+    parser.add_argument("--defaults-file", type=str, dest="defaults_file", metavar="FILE", help="Use MySQL configuration file")
 
 class ArgParser:
 
@@ -12,7 +23,7 @@ class ArgParser:
         Connection priority:
         1. Provided defaults file
         2. Command line arguments
-        3. ~/.my.cnf
+        3. ~/.my.cnf (only read when an option is not on the command line)
         """
         defaults_file = None
         host = '127.0.0.1'
@@ -23,39 +34,26 @@ class ArgParser:
         if self.args.defaults_file:
             defaults_file = self.args.defaults_file
             return defaults_file, host, port, user, password, socket
-        dot_my_cnf = os.path.expanduser("~/.my.cnf")
-        has_dot_my_cnf = True if exists(dot_my_cnf) else False
-        if has_dot_my_cnf:
-            parser = configparser.ConfigParser()
-            parser.read(dot_my_cnf)
-        if self.args.host:
-            host = self.args.host
-        elif has_dot_my_cnf:
-            try:
-                host = parser.get('client', 'host')
-            except:
-                pass
-        if self.args.user:
-            user = self.args.user
-        elif has_dot_my_cnf:
-            try:
-                user = parser.get('client', 'user')
-            except:
-                pass
         if self.args.ask_pass:
+            import getpass
             password = getpass.getpass()
         elif self.args.password:
             password = self.args.password
-        elif has_dot_my_cnf:
-            try:
-                password = parser.get('client', 'password')
-            except:
-                pass
-        if self.args.socket:
-            socket = self.args.socket
-        elif has_dot_my_cnf:
-            try:
-                socket = parser.get('client', 'socket')
-            except:
-                pass
-        return defaults_file, host, port, user, password, socket
+        given = {
+                "host": self.args.host,
+                "port": self.args.port,
+                "user": self.args.user,
+                "password": password,
+                "socket": self.args.socket
+                }
+        dot_my_cnf = expanduser("~/.my.cnf")
+        if None in given.values() and exists(dot_my_cnf):
+            import configparser
+            parser = configparser.ConfigParser()
+            parser.read(dot_my_cnf)
+            for option, value in given.items():
+                if value is None and parser.has_option('client', option):
+                    given[option] = parser.get('client', option)
+        host = given["host"] or host
+        port = int(given["port"] or port)
+        return defaults_file, host, port, given["user"], given["password"], given["socket"]
@@ -0,0 +1,276 @@
+from sys import intern
+import pymysql.cursors
+from crptoolkit.common import SYSTEM_SCHEMAS_SQL, read_snapshot, save_snapshot
+
+
+class Catalog:
+    """
+    Snapshot of the information_schema metadata used by the charset converter.
+    Every source is read exactly once (no server-side joins) and indexed by
+    schema, table and column so that checks and DDL run client-side.
+
+    Snapshots can be saved to disk and refreshed incrementally: only tables
+    that are new or whose CREATE_TIME or collation changed have their
+    columns, indexes and foreign keys reread. In-place changes that keep
+    CREATE_TIME (e.g. ALGORITHM=INSTANT ADD COLUMN) need a full load().
+    """
+
+    VERSION = 1
+    SNAPSHOT_SOURCES = ("collations", "schemata", "tables")
+    TABLE_SOURCES = ("columns", "statistics", "foreign_keys")
+
+    SOURCES = {
+            "collations": "SELECT collation_name, character_set_name FROM information_schema.collation_character_set_applicability",
+            "schemata": f"SELECT schema_name, default_character_set_name, default_collation_name FROM information_schema.schemata WHERE schema_name NOT IN {SYSTEM_SCHEMAS_SQL}",
+            "tables": f"SELECT table_schema, table_name, table_collation, data_length + index_length, UNIX_TIMESTAMP(create_time) FROM information_schema.tables WHERE table_schema NOT IN {SYSTEM_SCHEMAS_SQL} AND table_collation IS NOT NULL",
+            "columns": f"SELECT table_schema, table_name, column_name, data_type, character_maximum_length, character_set_name FROM information_schema.columns WHERE table_schema NOT IN {SYSTEM_SCHEMAS_SQL} AND (data_type LIKE '%char%' OR data_type LIKE '%text%')",
+            "statistics": f"SELECT table_schema, table_name, column_name, index_name, index_type, sub_part FROM information_schema.statistics WHERE table_schema NOT IN {SYSTEM_SCHEMAS_SQL} AND index_type <> 'FULLTEXT'",
+            "foreign_keys": f"SELECT table_schema, table_name, column_name, referenced_table_schema, referenced_table_name, referenced_column_name FROM information_schema.key_column_usage WHERE referenced_table_schema NOT IN {SYSTEM_SCHEMAS_SQL}"
+            }
+
+    def __init__(self, mysql, pool = None):
+        self.mysql = mysql
+        self.pool = pool
+        self.collations = {}
+        self.schemata = {}
+        self.tables = {}
+        self.columns = {}
+        self.statistics = {}
+        self.foreign_keys = []
+        self.variables = {}
+        self.server = None
+        self.saved = None
+
+    def load_source(self, source, sql, batch_size = 10000, mysql = None):
+        mysql = mysql if mysql is not None else self.mysql
+        loader = getattr(self, f"_load_{source}")
+        mysql.label = f"catalog {source}"
+        for rows in mysql.stream_batches(sql, cursorclass=pymysql.cursors.SSCursor, batch_size=batch_size):
+            loader(rows)
+
+    def load_sources(self, sources, batch_size = 10000):
+        """
+        Streams {source: sql}, concurrently over the connection pool when there is one.
+        Every source fills its own index, so loaders never share state.
+        """
+        if self.pool is None:
+            for source, sql in sources.items():
+                self.load_source(source, sql, batch_size)
+            return
+        jobs = {source: (lambda mysql, source = source, sql = sql: self.load_source(source, sql, batch_size, mysql)) for source, sql in sources.items()}
+        for _ in self.pool.run(jobs):
+            pass
+
+    def load(self, batch_size = 10000):
+        """
+        Streams every information_schema source once
+        Returns self
+        """
+        self.collations, self.schemata, self.tables = {}, {}, {}
+        self.columns, self.statistics, self.foreign_keys = {}, {}, []
+        self.load_sources(self.SOURCES, batch_size)
+        return self
+
+    def refresh(self, batch_size = 10000, chunk_size = 500, full_ratio = 0.5):
+        """
+        Rereads collations, schemata and tables, then columns, indexes and foreign keys of
+        changed tables only, {chunk_size} tables per statement. Falls back to load() when
+        there is no snapshot or more than {full_ratio} of the tables changed.
+        Returns number of tables reread
+        """
+        previous = self.tables
+        if not previous:
+            self.load(batch_size)
+            return sum(map(len, self.tables.values()))
+        self.collations, self.schemata, self.tables = {}, {}, {}
+        self.load_sources({source: self.SOURCES[source] for source in self.SNAPSHOT_SOURCES}, batch_size)
+        changed = []
+        for schema, tables in self.tables.items():
+            before = previous.get(schema, {})
+            for table, (collation, size, created) in tables.items():
+                if (old := before.get(table)) is None or old[0] != collation or old[2] != created:
+                    changed.append((schema, table))
+        total = sum(map(len, self.tables.values()))
+        if len(changed) > total * full_ratio:
+            self.load(batch_size)
+            return total
+        # Forget dropped and changed tables before rereading the changed ones
+        stale = set(changed)
+        keep = lambda schema, table: table in self.tables.get(schema, {}) and (schema, table) not in stale
+        for index in (self.columns, self.statistics):
+            for schema in list(index):
+                index[schema] = {table: value for table, value in index[schema].items() if keep(schema, table)}
+                if not index[schema]:
+                    del index[schema]
+        self.foreign_keys = [row for row in self.foreign_keys if keep(row[0], row[1])]
+        escape = self.mysql.connection.escape
+        for start in range(0, len(changed), chunk_size):
+            chunk = {}
+            for schema, table in changed[start:start + chunk_size]:
+                chunk.setdefault(schema, []).append(escape(table))
+            condition = " OR ".join(f"(table_schema = {escape(schema)} AND table_name IN ({', '.join(tables)}))" for schema, tables in chunk.items())
+            self.load_sources({source: f"{self.SOURCES[source]} AND ({condition})" for source in self.TABLE_SOURCES}, batch_size)
+        # Reread tables were appended, put them back in table order so reports match load()
+        order = {name: number for number, name in enumerate((schema, table) for schema, tables in self.tables.items() for table in tables)}
+        position = lambda schema, table: order.get((schema, table), len(order))
+        statistics = {}
+        for schema, table, indexes in sorted(((schema, table, indexes) for schema, tables in self.statistics.items() for table, indexes in tables.items()), key=lambda row: position(row[0], row[1])):
+            statistics.setdefault(schema, {})[table] = indexes
+        self.statistics = statistics
+        self.foreign_keys.sort(key=lambda row: position(row[0], row[1]))
+        return len(changed)
+
+    def save(self, path):
+        """
+        Writes the snapshot to {path} as gzip compressed JSON, replacing it atomically.
+        Only indexed and foreign key referenced columns are kept, the checks read no others.
+        """
+        wanted = {(schema, table, column) for schema, tables in self.statistics.items() for table, indexes in tables.items() for column, *_ in indexes}
+        wanted.update((schema, table, column) for *_, schema, table, column in self.foreign_keys)
+        columns = {}
+        for schema, table, column in wanted:
+            if (value := self.column(schema, table, column)) is not None:
+                columns.setdefault(schema, {}).setdefault(table, {})[column] = value
+        snapshot = {
+                "server": self.server,
+                "variables": self.variables,
+                "collations": self.collations,
+                "schemata": self.schemata,
+                "tables": self.tables,
+                "columns": columns,
+                "statistics": self.statistics,
+                "foreign_keys": self.foreign_keys
+                }
+        save_snapshot(path, self.VERSION, snapshot, compress=True, separators=(",", ":"))
+
+    def read(self, path):
+        """
+        Loads a snapshot written by save(). Snapshots from another format version are ignored.
+        Returns self
+        """
+        if (snapshot := read_snapshot(path, self.VERSION, compress=True)) is None:
+            return self
+        self.server = snapshot["server"]
+        self.saved = snapshot["saved"]
+        self.variables = snapshot["variables"]
+        self._load_collations(snapshot["collations"].items())
+        self._load_schemata((schema, *value) for schema, value in snapshot["schemata"].items())
+        self._load_tables((schema, table, *value) for schema, tables in snapshot["tables"].items() for table, value in tables.items())
+        self._load_columns((schema, table, column, *value) for schema, tables in snapshot["columns"].items() for table, columns in tables.items() for column, value in columns.items())
+        self._load_statistics((schema, table, *value) for schema, tables in snapshot["statistics"].items() for table, indexes in tables.items() for value in indexes)
+        self._load_foreign_keys(snapshot["foreign_keys"])
+        return self
+
+    def _load_collations(self, rows):
+        for collation, charset in rows:
+            self.collations[intern(collation)] = intern(charset)
+
+    def _load_schemata(self, rows):
+        for schema, charset, collation in rows:
+            self.schemata[intern(schema)] = (intern(charset), intern(collation))
+
+    def _load_tables(self, rows):
+        for schema, table, collation, size, created in rows:
+            self.tables.setdefault(intern(schema), {})[table] = (intern(collation), None if size is None else int(size), None if created is None else int(created))
+
+    def _load_columns(self, rows):
+        for schema, table, column, data_type, max_length, charset in rows:
+            columns = self.columns.setdefault(intern(schema), {}).setdefault(intern(table), {})
+            columns[intern(column)] = (intern(data_type), max_length, None if charset is None else intern(charset))
+
+    def _load_statistics(self, rows):
+        for schema, table, column, index_name, index_type, sub_part in rows:
+            indexes = self.statistics.setdefault(intern(schema), {}).setdefault(intern(table), [])
+            indexes.append((intern(column), intern(index_name), intern(index_type), sub_part))
+
+    def _load_foreign_keys(self, rows):
+        for row in rows:
+            self.foreign_keys.append(tuple(intern(value) for value in row))
+
+    def column(self, schema, table, column):
+        """
+        Looks up a string column
+        Returns (data_type, character_maximum_length, character_set_name) or None
+        """
+        return self.columns.get(schema, {}).get(table, {}).get(column)
+
+    def table_charset(self, collation):
+        return self.collations.get(collation)
+
+    def schemata_to_convert(self, charset, collation):
+        """
+        Databases whose defaults differ from charset/collation
+        Yields dictionaries
+        """
+        for schema, (schema_charset, schema_collation) in self.schemata.items():
+            if schema_charset != charset or schema_collation != collation:
+                yield {"schema_name": schema, "default_character_set_name": schema_charset, "default_collation_name": schema_collation}
+
+    def tables_to_convert(self, charset, collation, min_mb = None, max_mb = None):
+        """
+        Tables whose charset/collation differ, optionally filtered by rounded size in MB
+        Yields dictionaries
+        """
+        for schema, tables in self.tables.items():
+            for table, (table_collation, size, _) in tables.items():
+                table_charset = self.table_charset(table_collation)
+                if table_charset is None:
+                    continue
+                if table_charset == charset and table_collation == collation:
+                    continue
+                if min_mb is not None or max_mb is not None:
+                    if size is None:
+                        continue
+                    size_mb = (size + 524288) // 1048576
+                    if min_mb is not None and size_mb <= min_mb:
+                        continue
+                    if max_mb is not None and size_mb > max_mb:
+                        continue
+                yield {"table_schema": schema, "table_name": table, "character_set_name": table_charset, "table_collation": table_collation, "size": size}
+
+    def oversized_index_columns(self, max_bytes = 3072, bytes_per_char = 4, charset = "utf8mb4"):
+        """
+        Indexed string columns whose index prefix exceeds max_bytes once converted
+        Returns list of dictionaries (largest prefix first)
+        """
+        result = []
+        for schema, tables in self.statistics.items():
+            for table, indexes in tables.items():
+                for column_name, index_name, index_type, sub_part in indexes:
+                    if (column := self.column(schema, table, column_name)) is None:
+                        continue
+                    data_type, max_length, column_charset = column
+                    if column_charset is None or column_charset == charset:
+                        continue
+                    prefix = sub_part if sub_part is not None else max_length
+                    if prefix is None or (prefix_length := prefix * bytes_per_char) <= max_bytes:
+                        continue
+                    result.append({
+                        "table_schema": schema,
+                        "table_name": table,
+                        "column_name": column_name,
+                        "column_character_set": column_charset,
+                        "data_type": f"{data_type}({max_length})",
+                        "index_prefix_length": prefix_length,
+                        "index_name": index_name,
+                        "index_type": index_type,
+                        "index_sub_part": sub_part
+                        })
+        result.sort(key=lambda row: row["index_prefix_length"], reverse=True)
+        return result
+
+    def foreign_key_string_columns(self):
+        """
+        Foreign keys referencing string columns
+        Yields dictionaries
+        """
+        for schema, table, column_name, referenced_schema, referenced_table, referenced_column in self.foreign_keys:
+            if (column := self.column(referenced_schema, referenced_table, referenced_column)) is None:
+                continue
+            yield {
+                "table_name": table,
+                "column_name": column_name,
+                "referenced_table_name": referenced_table,
+                "referenced_column_name": referenced_column,
+                "data_type": column[0]
+                }
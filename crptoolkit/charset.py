@@ -0,0 +1,278 @@
+from os.path import exists
+from time import gmtime, strftime
+from crptoolkit.args import ArgParser
+from crptoolkit.catalog import Catalog
+from crptoolkit.common import SYSTEM_SCHEMAS_SQL
+from crptoolkit.executor import DDLExecutor, Journal, Throttle, ThrottleError
+from crptoolkit.logger import Logger
+from crptoolkit.mysql import ConnectionPool, MySQL
+from crptoolkit.output import Output
+from crptoolkit.scanner import DataScanner
+from crptoolkit.trace import QueryTracer
+
+CHARSET_VARIABLES = ('innodb_file_format', 'innodb_large_prefix', 'character_set_client', 'character_set_connection', 'character_set_database', 'character_set_results', 'character_set_server', 'collation_connection', 'collation_database', 'collation_server', 'default_collation_for_utf8mb4')
+
+class MySQLCharsetConversion:
+
+    def __init__(self, args, mysql = None, log = None):
+        self.args = ArgParser(args)
+        self.no_ddl = args.no_ddl
+        self.no_preflight = args.no_preflight
+        self.charset = args.charset
+        self.collation = args.collation
+        self.verbose = args.verbose
+        self.execute = args.execute
+        self.threads = args.threads
+        self.order = args.order
+        self.max_threads_running = args.max_threads_running
+        self.max_history_length = args.max_history_length
+        self.max_replica_lag = args.max_replica_lag
+        self.replicas = args.replicas
+        self.journal = args.journal
+        self.profile = args.profile
+        self.trace = args.trace
+        self.format = args.format
+        self.catalog_cache = args.catalog_cache
+        self.refresh_catalog = args.refresh_catalog
+        self.offline = args.offline
+        self.parallel = args.parallel
+        self.scan = args.scan
+        self.scan_chunk_time = args.scan_chunk_time
+        self.scan_sample = args.scan_sample
+        self.scan_budget = args.scan_budget
+        self.tracer = QueryTracer(self.trace) if self.profile or self.trace else None
+        if mysql is None:
+            # Offline runs never connect, the unconnected MySQL only carries labels
+            mysql = MySQL(None, None, None, None, None, None) if self.offline else MySQL(*self.args.connect())
+        if self.tracer is not None:
+            mysql.add_hook(self.tracer)
+        if mysql.connection is None and not self.offline:
+            mysql.connect()
+        self.defaults_file, self.host, self.port, self.user, self.password, self.socket = mysql.defaults_file, mysql.host, mysql.port, mysql.user, mysql.password, mysql.socket
+        self.mysql = mysql
+        self.log = log if log is not None else Logger(self.verbose, Output(self.format))
+        self.mysql.output = self.log.output
+        self.pool = ConnectionPool(self.mysql, self.parallel) if self.parallel > 1 and not self.offline else None
+        self.catalog = None
+        self.throttle = None
+
+    def validate(self):
+        self.mysql.label = "validate"
+        sql = f"SELECT 1 FROM information_schema.collation_character_set_applicability WHERE character_set_name='{self.charset}' AND collation_name='{self.collation}';"
+        valid = self.catalog.table_charset(self.collation) == self.charset if self.offline else self.mysql.run_query(sql, selectone=True)
+        if not valid:
+            self.log.warn(sql)
+            self.log.error(f"The character set and/or collation are not configured in MySQL or they are an incompatible combination.")
+        return valid
+
+    def variables(self):
+        """
+        Character set and collation global variables, fetched in one round-trip and cached
+        (read from the catalog cache with --offline)
+        Returns dictionary of variable name to value
+        """
+        if self.offline:
+            return self.catalog.variables
+        return self.mysql.get_variables(CHARSET_VARIABLES)
+
+    def load_catalog(self):
+        self.catalog = Catalog(self.mysql, self.pool)
+        if self.catalog_cache is not None and exists(self.catalog_cache) and not self.refresh_catalog:
+            self.catalog.read(self.catalog_cache)
+        if self.offline:
+            if self.catalog.saved is None:
+                self.log.error(f"No usable catalog cache in {self.catalog_cache}. Run once without --offline to create it.")
+            self.log.info(f"Using the schema catalog cached on {strftime('%Y-%m-%d %H:%M:%S', gmtime(self.catalog.saved))}.")
+        else:
+            server = self.mysql.get_variable("server_uuid") if self.catalog_cache is not None else None
+            if self.catalog.saved is not None and self.catalog.server != server:
+                self.log.warn(f"{self.catalog_cache} was saved from another server. Loading the schema catalog from scratch.")
+                self.catalog = Catalog(self.mysql, self.pool)
+            if self.catalog.saved is None:
+                self.log.info("Loading schema catalog...")
+                self.catalog.load()
+            else:
+                self.log.info("Refreshing cached schema catalog...")
+                self.log.verbose(f"Reread {self.catalog.refresh()} new or altered table(s).")
+            if self.catalog_cache is not None:
+                self.catalog.server = server
+                self.catalog.variables = self.variables()
+                self.catalog.save(self.catalog_cache)
+        self.log.verbose(f"Catalog loaded: {len(self.catalog.schemata)} databases, {sum(len(tables) for tables in self.catalog.tables.values())} tables.")
+        return self.catalog
+
+    def preflight_checks(self):
+        return {
+                1: {
+                    "info": "Character set and collation global variables",
+                    "rows": lambda: ({"Variable_name": name, "Value": value} for name, value in sorted(self.variables().items()) if value is not None)
+                    },
+                2: {
+                    "info": f"Databases that are not {self.charset} and {self.collation}",
+                    "rows": lambda: self.catalog.schemata_to_convert(self.charset, self.collation)
+                    },
+                3: {
+                    "info": f"Table that are not {self.charset} and {self.collation}",
+                    "rows": lambda: ({key: row[key] for key in ("table_schema", "table_name", "character_set_name", "table_collation")} for row in self.catalog.tables_to_convert(self.charset, self.collation))
+                    },
+                4: {
+                    "info": "Client connections overriding character set and collation session variables",
+                    "query": f"SELECT threads.* FROM ( SELECT t.processlist_user, t.processlist_db, v.variable_name, v.variable_value FROM performance_schema.threads AS t JOIN performance_schema.variables_by_thread AS v ON v.thread_id = t.thread_id WHERE t.processlist_user IS NOT NULL AND v.variable_name LIKE 'character_set_%' OR v.variable_name LIKE 'collation_%') threads JOIN ( SELECT variable_name, variable_value FROM performance_schema.global_variables WHERE variable_name LIKE 'character_set_%' OR variable_name LIKE 'collation_%') vars ON threads.variable_name = vars.variable_name WHERE threads.variable_value != vars.variable_value AND threads.processlist_db NOT IN {SYSTEM_SCHEMAS_SQL} GROUP BY threads.processlist_user, threads.processlist_db, threads.variable_name ORDER BY threads.processlist_user, threads.processlist_db;"
+                    },
+                5: {
+                    "info": "Indexed string columns > 3072 bytes (for utf8 -> utf8mb4 conversions)",
+                    "rows": lambda: self.catalog.oversized_index_columns()
+                    },
+                6: {
+                    "info": "Foreign Key string columns",
+                    "rows": lambda: self.catalog.foreign_key_string_columns()
+                    }
+                }
+
+    def preflight_rows(self, check, mysql = None):
+        """
+        Runs one preflight check (client-side or SQL), SQL checks on {mysql} if given
+        Returns iterator of dictionaries
+        """
+        if "rows" in check:
+            return check["rows"]()
+        self.log.verbose(check["query"])
+        return (mysql if mysql is not None else self.mysql).stream_query(check["query"])
+
+    def prefetch(self, key, check):
+        def job(mysql):
+            mysql.label = f"preflight {key}"
+            return list(self.preflight_rows(check, mysql))
+        return self.pool.submit(job)
+
+    def preflight(self):
+        checks = sorted(self.preflight_checks().items())
+        # SQL checks run on the pool while the client-side ones are printed, output stays in order
+        prefetched = {}
+        if self.pool is not None:
+            prefetched = {key: self.prefetch(key, check) for key, check in checks if "query" in check}
+        for key, check in checks:
+            self.mysql.label = f"preflight {key}"
+            if self.offline and "query" in check:
+                self.log.newline()
+                self.log.no_timestamp(f"{key}) {check['info']}:")
+                self.log.no_timestamp("Skipped with --offline")
+                continue
+            self.log.section(key, check["info"], prefetched[key].result() if key in prefetched else self.preflight_rows(check))
+
+    def ddl_commands(self):
+        return {
+                7: {
+                    "info": "Persist collation variables in the my.cnf",
+                    "rows": lambda: (f"{name} = {self.collation}" for name in ('collation_server', 'default_collation_for_utf8mb4') if self.variables()[name] is not None)
+                    },
+                8: {
+                    "info": "Perist character set variables in the my.cnf",
+                    "rows": lambda: (f"{name} = {self.charset}" for name in ('character_set_server',) if self.variables()[name] is not None)
+                    },
+                9: {
+                    "info": f"Configure runtime collation global variables to {self.collation}",
+                    "rows": lambda: (f'SET GLOBAL {name} = "{self.collation}";' for name in ('collation_connection', 'collation_database', 'collation_server', 'default_collation_for_utf8mb4') if self.variables()[name] not in (None, self.collation))
+                    },
+                10: {
+                    "info": f"Configure runtime character set global variables to {self.charset}",
+                    "rows": lambda: (f'SET GLOBAL {name} = "{self.charset}";' for name in ('character_set_client', 'character_set_connection', 'character_set_database', 'character_set_results', 'character_set_server') if self.variables()[name] not in (None, self.charset))
+                    },
+                11: {
+                    "info": f"DDL to alter databases to {self.charset} and {self.collation}",
+                    "rows": lambda: (f"ALTER DATABASE `{row['schema_name']}` DEFAULT CHARACTER SET {self.charset} COLLATE {self.collation};" for row in self.catalog.schemata_to_convert(self.charset, self.collation))
+                    },
+                12: {
+                    "info": f"DDL to alter tables <= 1G to {self.charset} and {self.collation}",
+                    "rows": lambda: (f"ALTER TABLE `{row['table_schema']}`.`{row['table_name']}` CONVERT TO CHARACTER SET {self.charset} COLLATE {self.collation};" for row in self.catalog.tables_to_convert(self.charset, self.collation, max_mb=1024))
+                    },
+                13: {
+                    "info": f"pt-online-schema-change DDL to alter tables > 1G to {self.charset} and {self.collation}",
+                    "rows": lambda: (f"pt-online-schema-change D={row['table_schema']},t={row['table_name']} --host=__source__ --alter=CONVERT TO CHARACTER SET {self.charset} COLLATE {self.collation}" for row in self.catalog.tables_to_convert(self.charset, self.collation, min_mb=1024))
+                    }
+                }
+
+    def ddl(self):
+        for key, command in sorted(self.ddl_commands().items()):
+            self.mysql.label = f"ddl {key}"
+            if self.format != "table":
+                self.log.section(key, command["info"], ({"command": line} for line in command["rows"]()))
+                continue
+            # Tables print the bare commands, ready to copy
+            self.log.newline()
+            self.log.no_timestamp(f"{key}) {command['info']}:")
+            empty = True
+            for line in command["rows"]():
+                empty = False
+                self.log.no_timestamp(line)
+            if empty:
+                self.log.no_timestamp("Empty set")
+
+    def load_throttle(self):
+        """
+        Throttle shared by the data scan and --execute, replicas are connected once with the
+        credentials of the source (from its defaults file with --defaults-file)
+        Returns Throttle
+        """
+        if self.throttle is None:
+            replicas = []
+            user, password = self.mysql.credentials()
+            for replica in self.replicas:
+                host, _, port = replica.partition(":")
+                mysql = MySQL(None, host, int(port) if port else 3306, user, password, None)
+                mysql.connect()
+                replicas.append(mysql)
+            self.throttle = Throttle(self.mysql, self.log, self.max_threads_running, self.max_replica_lag, self.max_history_length, replicas)
+        return self.throttle
+
+    def scan_data(self):
+        tables = [(row["table_schema"], row["table_name"]) for row in self.catalog.tables_to_convert(self.charset, self.collation)]
+        scanner = DataScanner(self.mysql, self.log, self.charset, self.pool, self.load_throttle(), self.scan_chunk_time, self.scan_sample, self.scan_budget)
+        try:
+            self.log.section("scan", f"Data that changes when converted to {self.charset}", scanner.run(tables))
+        except ThrottleError as e:
+            self.log.error(f"{e}. Start replication again or drop the replica from --replica.")
+
+    def execute_ddl(self):
+        tasks = [(f"`{row['schema_name']}`", None, f"ALTER DATABASE `{row['schema_name']}` DEFAULT CHARACTER SET {self.charset} COLLATE {self.collation};") for row in self.catalog.schemata_to_convert(self.charset, self.collation)]
+        tasks += [(f"`{row['table_schema']}`.`{row['table_name']}`", row["size"], f"ALTER TABLE `{row['table_schema']}`.`{row['table_name']}` CONVERT TO CHARACTER SET {self.charset} COLLATE {self.collation};") for row in self.catalog.tables_to_convert(self.charset, self.collation, max_mb=1024)]
+        executor = DDLExecutor(self.mysql, self.log, self.threads, self.order, self.load_throttle(), Journal(self.journal))
+        try:
+            failed = executor.run(tasks)
+        except ThrottleError as e:
+            self.log.error(f"{e}. Start replication again or drop the replica from --replica, then rerun with the same --journal to resume.")
+        if failed:
+            self.log.error(f"{failed} statement(s) failed. Fix them and rerun with the same --journal to resume.")
+        if any(self.catalog.tables_to_convert(self.charset, self.collation, min_mb=1024)):
+            self.log.warn("Tables > 1G were not converted. Run the pt-online-schema-change commands for them.")
+
+    def run(self):
+        # Persist sql
+        self.log.info(f"[ START ] Running MySQL character set conversion for: {self.charset} and {self.collation}")
+        if self.offline:
+            self.load_catalog()
+        self.validate()
+        if not self.offline and (not self.no_preflight or not self.no_ddl or self.execute or self.scan or self.catalog_cache is not None):
+            self.load_catalog()
+        if not self.no_preflight:
+            self.log.info("Performing preflight checks...")
+            self.preflight()
+        if self.scan:
+            self.log.newline()
+            self.log.info(f"Scanning table data with {max(1, self.parallel)} connection(s)...")
+            self.scan_data()
+        if not self.no_ddl:
+            self.log.newline()
+            self.log.info("Generating commands and DDL statements...")
+            self.log.warn("Only run the following commands if you are sure the database is ready!")
+            self.ddl()
+        if self.execute:
+            self.log.newline()
+            self.log.info(f"Executing DDL with {self.threads} thread(s)...")
+            self.execute_ddl()
+        if self.pool is not None:
+            self.pool.close()
+        if self.tracer is not None:
+            self.tracer.report(self.log, self.profile)
+        self.log.newline()
+        self.log.info(f"[ COMPLETED ]")
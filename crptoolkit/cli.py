@@ -0,0 +1,233 @@
+import argparse
+import importlib
+import sys
+from crptoolkit.args import add_connection_args
+from crptoolkit.output import FORMATS
+
+# Only argparse is needed to parse a command line. Each command's implementation (and
+# pymysql with it) is imported once the command is known, so --help and usage errors stay fast.
+
+def add_output_args(parser, profile = True):
+    parser.add_argument("-v", "--verbose", dest="verbose", action="store_true", help="Print additional tool information")
+    parser.add_argument("--format", type=str, dest="format", default="table", choices=FORMATS, help="Result format: aligned table for small results, or streamed tsv, csv or jsonl (default: table)")
+    if profile:
+        parser.add_argument("--profile", dest="profile", action="store_true", help="Print a per-step summary of query timings")
+        parser.add_argument("--trace", type=str, dest="trace", metavar="FILE", help="Write every statement's timings to FILE as JSON lines")
+
+def add_fleet_args(parser):
+    parser.add_argument("-u", "--user", type=str, dest="user", help="MySQL user")
+    parser.add_argument("-p", "--password", type=str, dest="password", metavar="PASS", help="MySQL password")
+    parser.add_argument("--ask-pass", dest="ask_pass", action="store_true", help="Ask for password")
+
+def add_prepare_args(parser):
+    parser.add_argument("-t", "--no-transaction-check", action="store_true", dest="no_transaction_check",
+                        help="Do not check for long running transactions")
+    parser.add_argument("--transaction-threshold", type=int, dest="transaction_threshold", default=60, metavar="SECONDS",
+                        help="Transactions running longer than this block the shutdown (default: 60)")
+    parser.add_argument("--replication-timeout", type=int, dest="replication_timeout", default=60, metavar="SECONDS",
+                        help="Maximum time to wait for the SQL thread to catch up before stopping it (default: 60)")
+    parser.add_argument("--flush-target", type=float, dest="flush_target", default=10, metavar="SECONDS",
+                        help="Stop waiting for dirty pages once the projected shutdown flush time is under this (default: 10)")
+    parser.add_argument("--flush-timeout", type=float, dest="flush_timeout", default=300, metavar="SECONDS",
+                        help="Maximum time to wait for dirty pages to flush (default: 300)")
+    parser.add_argument("--shutdown-budget", type=float, dest="shutdown_budget", metavar="SECONDS",
+                        help="Wait until the projected slow shutdown time (flush, purge and change buffer merge) is under this")
+    parser.add_argument("--readiness-timeout", type=float, dest="readiness_timeout", default=300, metavar="SECONDS",
+                        help="Maximum time to wait for --shutdown-budget (default: 300)")
+
+def add_charset_args(parser):
+    parser.add_argument("-c", "--charset", type=str, dest="charset", default="utf8mb4", help="Charset to convert to (default: utf8mb4)")
+    parser.add_argument("-l", "--collation", type=str, dest="collation", default="utf8mb4_0900_ai_ci", help="Collation to convert to (default: utf8mb4_0900_ai_ci)")
+    parser.add_argument("--no-preflight", action="store_true", dest="no_preflight", help="Do not perform preflight checks")
+    parser.add_argument("--no-ddl", action="store_true", dest="no_ddl", help="Do not generate DDL statements")
+
+def prepare_shutdown_args(parser):
+    add_connection_args(parser)
+    add_prepare_args(parser)
+    parser.add_argument("--watch-transactions", type=int, dest="watch_transactions", default=0, metavar="SECONDS",
+                        help="Watch long running transactions for up to SECONDS, reporting new, finished and growing ones, before giving up (default: 0, abort at once)")
+    parser.add_argument("--watch-interval", type=float, dest="watch_interval", default=2, metavar="SECONDS",
+                        help="Sampling interval for --watch-transactions (default: 2)")
+    parser.add_argument("--warmup-capture", type=str, dest="warmup_capture", metavar="FILE",
+                        help="Save the most read indexes and the buffer pool hit ratio to FILE for crp-warmup --capture")
+    add_output_args(parser)
+
+def charset_converter_args(parser):
+    add_connection_args(parser)
+    add_output_args(parser)
+    add_charset_args(parser)
+    parser.add_argument("--parallel", type=int, dest="parallel", default=1, metavar="N", help="Read the schema catalog, run SQL preflight checks and --scan over N extra connections, large tables are scanned on all of them (default: 1, sequential on the main connection)")
+    parser.add_argument("--scan", action="store_true", dest="scan", help="Scan the data of tables to convert for lossy values, byte growth, 4-byte characters and UTF-8 stored in single-byte columns (throttled like --execute)")
+    parser.add_argument("--scan-chunk-time", type=float, dest="scan_chunk_time", default=0.5, metavar="SECONDS", help="Size --scan chunks to take about SECONDS each (default: 0.5)")
+    parser.add_argument("--scan-sample", type=float, dest="scan_sample", default=100, metavar="PCT", help="Only read PCT percent of the primary key range of tables with an integer primary key and project the rest (default: 100)")
+    parser.add_argument("--scan-budget", type=float, dest="scan_budget", metavar="SECONDS", help="Stop scanning a table, or each key range of a split table, after SECONDS and project the rest")
+    parser.add_argument("--execute", action="store_true", dest="execute", help="Execute the ALTER DATABASE and ALTER TABLE (<= 1G) statements")
+    parser.add_argument("--threads", type=int, dest="threads", default=4, help="Maximum concurrent ALTER statements with --execute (default: 4)")
+    parser.add_argument("--order", type=str, dest="order", default="longest", choices=["longest", "shortest"], help="Run the largest or smallest tables first with --execute (default: longest)")
+    parser.add_argument("--max-threads-running", type=int, dest="max_threads_running", default=50, metavar="N", help="Pause --execute while Threads_running is above N (default: 50)")
+    parser.add_argument("--max-history-length", type=int, dest="max_history_length", metavar="N", help="Pause --execute while the InnoDB history list length is above N")
+    parser.add_argument("--max-replica-lag", type=int, dest="max_replica_lag", metavar="SECONDS", help="Pause --execute while any --replica lags more than SECONDS")
+    parser.add_argument("--replica", type=str, dest="replicas", action="append", default=[], metavar="HOST[:PORT]", help="Replica to check with --max-replica-lag (repeatable, same user and password, also from --defaults-file)")
+    parser.add_argument("--journal", type=str, dest="journal", metavar="FILE", help="Record finished statements in FILE and skip them when resuming with --execute")
+    parser.add_argument("--catalog-cache", type=str, dest="catalog_cache", metavar="FILE", help="Keep a snapshot of the schema catalog in FILE and only reread new or altered tables on later runs")
+    parser.add_argument("--refresh-catalog", action="store_true", dest="refresh_catalog", help="Reload the whole schema catalog instead of refreshing --catalog-cache")
+    parser.add_argument("--offline", action="store_true", dest="offline", help="Do not connect to MySQL, report and generate DDL from --catalog-cache")
+
+def charset_converter_check(parser, args):
+    if args.offline and args.catalog_cache is None:
+        parser.error("--offline requires --catalog-cache")
+    if args.offline and (args.execute or args.scan):
+        parser.error("--offline cannot be combined with --execute or --scan")
+    if not 0 < args.scan_sample <= 100:
+        parser.error("--scan-sample must be between 0 and 100")
+
+def charset_fleet_args(parser):
+    add_fleet_args(parser)
+    parser.add_argument("-i", "--inventory", type=str, dest="inventory", required=True, metavar="FILE",
+                        help="File with one host[:port] or MySQL defaults file per line")
+    parser.add_argument("--fleet-threads", type=int, dest="fleet_threads", default=16, metavar="N", help="Hosts to audit at once (default: 16)")
+    parser.add_argument("--timeout", type=float, dest="timeout", default=600, metavar="SECONDS", help="Give up on a host that is not audited after SECONDS (default: 600)")
+    parser.add_argument("--connect-timeout", type=int, dest="connect_timeout", default=10, metavar="SECONDS", help="Per-host connect timeout (default: 10)")
+    add_output_args(parser, profile=False)
+    add_charset_args(parser)
+    parser.set_defaults(host=None, port=None, socket=None, defaults_file=None, execute=False, threads=1, order="longest",
+                        max_threads_running=None, max_history_length=None, max_replica_lag=None, replicas=[], journal=None,
+                        profile=False, trace=None, catalog_cache=None, refresh_catalog=False, offline=False, parallel=1,
+                        scan=False, scan_chunk_time=0.5, scan_sample=100, scan_budget=None)
+
+def rolling_shutdown_args(parser):
+    add_fleet_args(parser)
+    parser.add_argument("-i", "--inventory", type=str, dest="inventory", required=True, metavar="FILE",
+                        help="File with one host[:port] or MySQL defaults file per line, followed by its replication group")
+    parser.add_argument("--state", type=str, dest="state", metavar="FILE",
+                        help="Checkpoint progress to FILE, and resume from it if it exists")
+    parser.add_argument("--concurrency", type=int, dest="concurrency", default=1, metavar="N", help="Hosts per wave (default: 1)")
+    parser.add_argument("--min-healthy", type=int, dest="min_healthy", default=1, metavar="N",
+                        help="Serving replicas every replication group keeps during a wave (default: 1)")
+    parser.add_argument("--max-lag", type=int, dest="max_lag", default=30, metavar="SECONDS",
+                        help="A replica lagging more than this is not serving, and not caught up after its restart (default: 30)")
+    parser.add_argument("--restart-command", type=str, dest="restart_command", metavar="COMMAND",
+                        help="Command run for each prepared host, e.g. \"ssh {host} sudo systemctl restart mysql\" ({name}, {host} and {port} are replaced). Without it, hosts are restarted by someone else")
+    parser.add_argument("--restart-timeout", type=float, dest="restart_timeout", default=1800, metavar="SECONDS",
+                        help="Maximum time for a prepared host to come back after its restart (default: 1800)")
+    parser.add_argument("--catchup-timeout", type=float, dest="catchup_timeout", default=1800, metavar="SECONDS",
+                        help="Maximum time for a restarted host to catch up on replication (default: 1800)")
+    parser.add_argument("--health-timeout", type=float, dest="health_timeout", default=600, metavar="SECONDS",
+                        help="Maximum time to wait for enough serving replicas to start the next wave (default: 600)")
+    parser.add_argument("--interval", type=float, dest="interval", default=10, metavar="SECONDS", help="Polling interval (default: 10)")
+    parser.add_argument("--timeout", type=int, dest="timeout", default=60, metavar="SECONDS", help="Health check connect and query timeout (default: 60)")
+    add_prepare_args(parser)
+    add_output_args(parser, profile=False)
+    parser.set_defaults(host=None, port=None, socket=None, defaults_file=None, watch_transactions=0, watch_interval=2,
+                        warmup_capture=None, profile=False, trace=None)
+
+def rolling_shutdown_check(parser, args):
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+    if args.min_healthy < 0:
+        parser.error("--min-healthy cannot be negative")
+
+def warmup_args(parser):
+    add_connection_args(parser)
+    parser.add_argument("--load-now", dest="load_now", action="store_true",
+                        help="Start a buffer pool load from the dump file (default: follow the load started by innodb_buffer_pool_load_at_startup)")
+    parser.add_argument("--no-load", dest="no_load", action="store_true", help="Do not start or follow a buffer pool load")
+    parser.add_argument("--load-timeout", type=float, dest="load_timeout", default=3600, metavar="SECONDS",
+                        help="Maximum time to follow the buffer pool load (default: 3600)")
+    parser.add_argument("--capture", type=str, dest="capture", metavar="FILE",
+                        help="Capture written by crp-prepare-shutdown --warmup-capture, to pre-read the hottest indexes and compare with the baseline")
+    parser.add_argument("--preread", type=int, dest="preread", default=100, metavar="N",
+                        help="Pre-read up to the N most read indexes of the capture, 0 to skip (default: 100)")
+    parser.add_argument("--parallel", type=int, dest="parallel", default=4, metavar="N",
+                        help="Indexes pre-read at once, each over its own connection (default: 4)")
+    parser.add_argument("--tolerance", type=float, dest="tolerance", default=10, metavar="PERCENT",
+                        help="How close to the baseline miss ratio and disk read rate counts as warm (default: 10)")
+    parser.add_argument("--monitor-timeout", type=float, dest="monitor_timeout", default=1800, metavar="SECONDS",
+                        help="Maximum time to wait for the baseline, 0 to skip (default: 1800)")
+    parser.add_argument("-i", "--interval", type=float, dest="interval", default=5, metavar="SECONDS",
+                        help="Polling interval (default: 5)")
+    add_output_args(parser)
+
+def warmup_check(parser, args):
+    if args.load_now and args.no_load:
+        parser.error("--load-now and --no-load are mutually exclusive")
+    if args.parallel < 1:
+        parser.error("--parallel must be at least 1")
+
+def watch_transactions_args(parser):
+    add_connection_args(parser)
+    parser.add_argument("-t", "--threshold", type=int, dest="threshold", default=60, metavar="SECONDS",
+                        help="Only report transactions running longer than this (default: 60)")
+    parser.add_argument("-i", "--interval", type=float, dest="interval", default=2, metavar="SECONDS",
+                        help="Sampling interval (default: 2)")
+    parser.add_argument("-d", "--duration", type=float, dest="duration", metavar="SECONDS",
+                        help="Stop watching after this long (default: until interrupted)")
+    add_output_args(parser, profile=False)
+
+COMMANDS = {
+        "prepare-shutdown": {
+            "help": "Prepare MySQL for a graceful (slow) shutdown",
+            "args": prepare_shutdown_args,
+            "run": "crptoolkit.shutdown:MySQLPrepareShutdown"
+            },
+        "rolling-shutdown": {
+            "help": "Prepare, restart and wait for replicas of a fleet in waves",
+            "args": rolling_shutdown_args,
+            "check": rolling_shutdown_check,
+            "run": "crptoolkit.rolling:MySQLRollingShutdown"
+            },
+        "warmup": {
+            "help": "Load and pre-read the buffer pool after a restart and wait for the baseline",
+            "args": warmup_args,
+            "check": warmup_check,
+            "run": "crptoolkit.warmup:MySQLWarmup"
+            },
+        "watch-transactions": {
+            "help": "Report long running transactions as they start, grow and finish",
+            "args": watch_transactions_args,
+            "run": "crptoolkit.watch:MySQLWatchTransactions"
+            },
+        "charset-converter": {
+            "help": "Preflight, generate and execute a character set conversion",
+            "args": charset_converter_args,
+            "check": charset_converter_check,
+            "run": "crptoolkit.charset:MySQLCharsetConversion"
+            },
+        "charset-fleet": {
+            "help": "Audit a character set conversion across a fleet",
+            "args": charset_fleet_args,
+            "run": "crptoolkit.fleet:MySQLCharsetFleet"
+            }
+        }
+
+def parse_args(argv):
+    """
+    Builds the options of the requested command only (the others just list their help line)
+    Returns argparse.Namespace
+    """
+    parser = argparse.ArgumentParser(prog="crp", description="CRP Toolkit")
+    subparsers = parser.add_subparsers(dest="command", metavar="COMMAND", required=True)
+    for name, command in COMMANDS.items():
+        subparser = subparsers.add_parser(name, help=command["help"], description=command["help"])
+        if argv and argv[0] == name:
+            command["args"](subparser)
+            args = parser.parse_args(argv)
+            if "check" in command:
+                command["check"](subparser, args)
+            return args
+    return parser.parse_args(argv)
+
+def load(name):
+    """
+    Imports the implementation of a command
+    Returns class
+    """
+    module, _, attribute = COMMANDS[name]["run"].partition(":")
+    return getattr(importlib.import_module(module), attribute)
+
+def main(argv = None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    load(args.command)(args).run()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+import gzip
+import json
+import os
+from time import time
+
+SYSTEM_SCHEMAS = ("information_schema", "mysql", "performance_schema", "sys")
+# For NOT IN (...) filters
+SYSTEM_SCHEMAS_SQL = "(" + ", ".join(f"'{schema}'" for schema in SYSTEM_SCHEMAS) + ")"
+
+def quote(name):
+    return "`" + name.replace("`", "``") + "`"
+
+def save_snapshot(path, version, snapshot, compress = False, **options):
+    """
+    Writes {snapshot} as JSON (gzip compressed with {compress}) stamped with its format {version}
+    and the time it was saved. The file is written next to {path} and replaced atomically, so an
+    interrupted save never leaves a partial snapshot. {options} are passed to json.dumps().
+    """
+    # One dumps() and write() is several times faster than json.dump() into a gzip stream
+    text = json.dumps({"version": version, "saved": time(), **snapshot}, **options)
+    if compress:
+        with gzip.open(f"{path}.tmp", "wb", compresslevel=6) as file:
+            file.write(text.encode("utf-8"))
+    else:
+        with open(f"{path}.tmp", "w") as file:
+            file.write(text)
+    os.replace(f"{path}.tmp", path)
+
+def read_snapshot(path, version, compress = False):
+    """
+    Loads a snapshot written by save_snapshot()
+    Returns dictionary or None if it is from another format version
+    """
+    with (gzip.open(path, "rb") if compress else open(path)) as file:
+        snapshot = json.loads(file.read())
+    return snapshot if snapshot.get("version") == version else None
@@ -0,0 +1,173 @@
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from os.path import exists
+from threading import Lock
+from time import gmtime, monotonic, sleep, strftime
+
+class ThrottleError(Exception):
+    pass
+
+class Throttle:
+    """
+    Pauses work while the server (or its replicas) is over the configured load thresholds.
+    Checks share one monitor connection, so they are serialized with a lock.
+    A replica whose lag cannot be measured (not replicating) raises ThrottleError instead
+    of pausing forever, and every later wait() raises it again.
+    """
+
+    def __init__(self, mysql, log, max_threads_running = None, max_replica_lag = None, max_history_length = None, replicas = (), interval = 5):
+        self.mysql = mysql
+        self.log = log
+        self.max_threads_running = max_threads_running
+        self.max_replica_lag = max_replica_lag
+        self.max_history_length = max_history_length
+        self.replicas = list(replicas)
+        self.interval = interval
+        self.lock = Lock()
+        self.failure = None
+
+    def check(self):
+        """
+        Compares current load with the thresholds
+        Returns list of reasons to pause (empty when it is safe to continue)
+        """
+        reasons = []
+        if self.max_threads_running is not None:
+            threads_running = int(self.mysql.get_status_variable("Threads_running"))
+            if threads_running > self.max_threads_running:
+                reasons.append(f"Threads_running = {threads_running} > {self.max_threads_running}")
+        if self.max_history_length is not None:
+            sql = "SELECT count FROM information_schema.innodb_metrics WHERE name = 'trx_rseg_history_len'"
+            history_length = int(self.mysql.run_query(sql)[0]["count"])
+            if history_length > self.max_history_length:
+                reasons.append(f"history list length = {history_length} > {self.max_history_length}")
+        if self.max_replica_lag is not None:
+            for replica in self.replicas:
+                if (status := replica.replica_status()) is None:
+                    raise ThrottleError(f"{replica.host}:{replica.port} is not a replica, its lag cannot be checked with --max-replica-lag")
+                if status["Slave_SQL_Running"] != "Yes" or status["Slave_IO_Running"] == "No":
+                    raise ThrottleError(f"Replication is stopped on {replica.host}:{replica.port} (IO {status['Slave_IO_Running']}, SQL {status['Slave_SQL_Running']}), its lag cannot be checked with --max-replica-lag")
+                # NULL while the IO thread reconnects
+                if (lag := status["Seconds_Behind_Master"]) is None or lag > self.max_replica_lag:
+                    reasons.append(f"replica {replica.host}:{replica.port} lag = {lag} > {self.max_replica_lag}")
+        return reasons
+
+    def wait(self):
+        """
+        Blocks until every threshold is respected
+        """
+        with self.lock:
+            if self.failure is not None:
+                raise self.failure
+            try:
+                while (reasons := self.check()):
+                    self.log.warn(f"Throttling: {', '.join(reasons)}. Pausing {self.interval} seconds.")
+                    sleep(self.interval)
+            except ThrottleError as e:
+                self.failure = e
+                raise
+
+class Journal:
+    """
+    Append-only JSON lines record of finished statements, so an interrupted run can resume.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = Lock()
+        self.done = set()
+        if path is not None and exists(path):
+            with open(path) as journal:
+                for line in journal:
+                    if (line := line.strip()):
+                        entry = json.loads(line)
+                        if entry["status"] == "done":
+                            self.done.add(entry["ddl"])
+
+    def record(self, ddl, status, seconds, error = None):
+        if self.path is None:
+            return
+        entry = {"finished_at": strftime("%Y-%m-%d %H:%M:%S", gmtime()), "ddl": ddl, "status": status, "seconds": round(seconds, 3)}
+        if error is not None:
+            entry["error"] = error
+        with self.lock:
+            with open(self.path, "a") as journal:
+                journal.write(json.dumps(entry) + "\n")
+            if status == "done":
+                self.done.add(ddl)
+
+class DDLExecutor:
+    """
+    Runs DDL statements through a bounded pool of worker connections, ordered by size.
+    """
+
+    def __init__(self, mysql, log, threads = 4, order = "longest", throttle = None, journal = None):
+        self.mysql = mysql
+        self.log = log
+        self.threads = threads
+        self.order = order
+        self.throttle = throttle
+        self.journal = journal if journal is not None else Journal(None)
+
+    def schedule(self, tasks):
+        """
+        Drops finished statements and orders the rest by size (unknown sizes last)
+        Returns list of (name, size, ddl)
+        """
+        pending = [task for task in tasks if task[2] not in self.journal.done]
+        if (skipped := len(tasks) - len(pending)):
+            self.log.info(f"Skipping {skipped} statement(s) already completed according to the journal.")
+        longest = self.order == "longest"
+        return sorted(pending, key=lambda task: (task[1] is None, -(task[1] or 0) if longest else (task[1] or 0)))
+
+    def worker(self, task, connections):
+        name, size, ddl = task
+        if self.throttle is not None:
+            self.throttle.wait()
+        mysql = connections.pop() if connections else self.mysql.clone()
+        mysql.label = "execute"
+        start = monotonic()
+        try:
+            self.log.verbose(ddl)
+            mysql.run_query(ddl)
+        except Exception as e:
+            self.journal.record(ddl, "failed", monotonic() - start, str(e))
+            raise
+        finally:
+            connections.append(mysql)
+        elapsed = monotonic() - start
+        self.journal.record(ddl, "done", elapsed)
+        return name, elapsed
+
+    def run(self, tasks):
+        """
+        Executes (name, size, ddl) tasks with at most {threads} running at once
+        Returns number of failed statements
+        """
+        tasks = self.schedule(tasks)
+        connections = []
+        failed = 0
+        finished = 0
+        with ThreadPoolExecutor(max_workers=self.threads) as pool:
+            futures = {pool.submit(self.worker, task, connections): task for task in tasks}
+            try:
+                for future in as_completed(futures):
+                    finished += 1
+                    name = futures[future][0]
+                    try:
+                        name, elapsed = future.result()
+                        self.log.info(f"[{finished}/{len(tasks)}] Converted {name} in {elapsed:.1f} seconds.")
+                    except ThrottleError:
+                        for future in futures:
+                            future.cancel()
+                        raise
+                    except Exception as e:
+                        failed += 1
+                        self.log.warn(f"[{finished}/{len(tasks)}] Failed to convert {name}: {e}")
+            except KeyboardInterrupt:
+                for future in futures:
+                    future.cancel()
+                raise
+        for mysql in connections:
+            mysql.connection.close()
+        return failed
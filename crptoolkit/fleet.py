@@ -0,0 +1,226 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from io import StringIO
+from os.path import exists
+from pymysql.err import MySQLError
+from threading import Lock
+from time import monotonic
+from crptoolkit.args import ArgParser
+from crptoolkit.charset import MySQLCharsetConversion
+from crptoolkit.logger import Logger
+from crptoolkit.mysql import MySQL
+from crptoolkit.output import Output
+
+class HostError(Exception):
+    pass
+
+class HostLogger(Logger):
+    """
+    Keeps a host's messages instead of printing them, so fleet output is not interleaved.
+    Rows (its own and those MySQL renders to the logger's output) are rendered in {format}
+    into a private buffer and kept among the messages as ("rows", text).
+    error() raises HostError instead of exiting.
+    """
+
+    def __init__(self, name, verbose_info, format = "table"):
+        self.buffer = StringIO()
+        super().__init__(verbose_info, Output(format, self.buffer))
+        self.name = name
+        self.messages = []
+
+    def collect(self):
+        """
+        Moves the rows rendered since the last message in among the messages, keeping their order
+        Returns list of (level, message)
+        """
+        self.output.flush()
+        if (text := self.buffer.getvalue()):
+            self.messages.append(("rows", text))
+            self.buffer.seek(0)
+            self.buffer.truncate()
+        return self.messages
+
+    def info(self, message):
+        self.collect().append(("info", message))
+
+    def verbose(self, message):
+        if self.verbose_info:
+            self.collect().append(("verbose", message))
+
+    def warn(self, message):
+        self.collect().append(("warning", message))
+
+    def error(self, message):
+        self.collect().append(("critical", message))
+        raise HostError(message)
+
+    def no_timestamp(self, message):
+        pass
+
+    def newline(self):
+        pass
+
+def read_inventory(path):
+    """
+    Reads one target per line: host[:port] or the path to a MySQL defaults file.
+    Blank lines and # comments are ignored, extra whitespace separated fields are kept as tags.
+    Returns list of dictionaries
+    """
+    targets = []
+    with open(path) as inventory:
+        for line in inventory:
+            if not (fields := line.split("#", 1)[0].split()):
+                continue
+            entry, tags = fields[0], fields[1:]
+            if exists(entry):
+                targets.append({"name": entry, "defaults_file": entry, "host": None, "port": None, "tags": tags})
+                continue
+            host, _, port = entry.partition(":")
+            targets.append({"name": f"{host}:{port or 3306}", "defaults_file": None, "host": host, "port": int(port) if port else 3306, "tags": tags})
+    return targets
+
+def connect(target, user, password, timeout = None, connect_timeout = None):
+    """
+    Connects to an inventory target (defaults file targets carry their own credentials)
+    Returns MySQL
+    """
+    mysql = MySQL(target["defaults_file"], target["host"], target["port"], user, password, None, timeout, connect_timeout)
+    mysql.connect()
+    return mysql
+
+def kill(mysql):
+    """
+    Kills the connection of {mysql} from a new connection, so a query blocked on it fails at once
+    Returns boolean
+    """
+    try:
+        killer = mysql.clone()
+    except MySQLError:
+        return False
+    try:
+        killer.run_query(f"KILL {mysql.connection.thread_id()}")
+        return True
+    except MySQLError:
+        return False
+    finally:
+        killer.connection.close()
+
+def run_fleet(targets, function, threads = 16, timeout = None, cancel = None):
+    """
+    Calls function(target) for every target with at most {threads} hosts at once.
+    A host still running {timeout} seconds after it started is reported as failed at once
+    and cancel(target) is called to stop its work.
+    Yields (target, result, error, seconds) as hosts finish
+    """
+    started = {}
+
+    def timed(target):
+        start = started[target["name"]] = monotonic()
+        try:
+            return function(target), None, monotonic() - start
+        except (Exception, SystemExit) as e:
+            return None, e, monotonic() - start
+
+    pool = ThreadPoolExecutor(max_workers=threads)
+    futures = {pool.submit(timed, target): target for target in targets}
+    try:
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=None if timeout is None else 1, return_when=FIRST_COMPLETED)
+            for future in done:
+                result, error, seconds = future.result()
+                yield futures[future], result, error, seconds
+            if timeout is None:
+                continue
+            now = monotonic()
+            for future in [future for future in pending if now - started.get(futures[future]["name"], now) >= timeout]:
+                # The worker's late result is dropped, its host is already reported
+                pending.discard(future)
+                if cancel is not None:
+                    cancel(futures[future])
+                yield futures[future], None, HostError(f"Gave up after the {timeout:g} seconds host timeout"), now - started[futures[future]["name"]]
+    finally:
+        for future in futures:
+            future.cancel()
+        pool.shutdown(wait=False)
+
+class MySQLCharsetFleet:
+
+    def __init__(self, args):
+        self.args = args
+        self.inventory = args.inventory
+        self.fleet_threads = args.fleet_threads
+        self.timeout = args.timeout
+        self.connect_timeout = args.connect_timeout
+        self.no_preflight = args.no_preflight
+        self.no_ddl = args.no_ddl
+        self.charset = args.charset
+        self.collation = args.collation
+        self.verbose = args.verbose
+        _, _, _, self.user, self.password, _ = ArgParser(args).connect()
+        self.format = args.format
+        self.log = Logger(self.verbose, Output(self.format))
+        self.connections = {}
+        self.lock = Lock()
+
+    def audit(self, target):
+        """
+        Runs validate(), preflight and DDL generation against one host
+        Returns dictionary of check number to (info, rows)
+        """
+        mysql = connect(target, self.user, self.password, connect_timeout=self.connect_timeout)
+        with self.lock:
+            self.connections[target["name"]] = mysql
+        try:
+            conversion = MySQLCharsetConversion(self.args, mysql, HostLogger(target["name"], self.verbose, self.format))
+            conversion.validate()
+            conversion.load_catalog()
+            findings = {}
+            if not self.no_preflight:
+                for key, check in conversion.preflight_checks().items():
+                    findings[key] = (check["info"], list(conversion.preflight_rows(check)))
+            if not self.no_ddl:
+                for key, command in conversion.ddl_commands().items():
+                    findings[key] = (command["info"], [{"command": line} for line in command["rows"]()])
+            return findings
+        finally:
+            with self.lock:
+                self.connections.pop(target["name"], None)
+            mysql.connection.close()
+
+    def cancel(self, target):
+        """
+        Kills the query a host that ran out of time is blocked on
+        """
+        with self.lock:
+            mysql = self.connections.get(target["name"])
+        if mysql is not None and not kill(mysql):
+            self.log.verbose(f"Could not kill the connection to {target['name']}, it is left to finish on its own.")
+
+    def report(self, findings):
+        for key in sorted(findings):
+            info, rows = findings[key]
+            self.log.section(key, info, rows)
+
+    def run(self):
+        targets = read_inventory(self.inventory)
+        self.log.info(f"[ START ] Auditing {len(targets)} host(s) for: {self.charset} and {self.collation}")
+        findings = {}
+        hosts = []
+        failed = 0
+        for target, result, error, seconds in run_fleet(targets, self.audit, self.fleet_threads, self.timeout, self.cancel):
+            if error is not None:
+                failed += 1
+                hosts.append({"host": target["name"], "status": "failed", "seconds": f"{seconds:.1f}", "message": str(error) or type(error).__name__})
+                self.log.warn(f"{target['name']} failed after {seconds:.1f} seconds: {error}")
+                continue
+            hosts.append({"host": target["name"], "status": "ok", "seconds": f"{seconds:.1f}", "message": ""})
+            self.log.verbose(f"{target['name']} audited in {seconds:.1f} seconds.")
+            # Different hosts are merged per check with the host name as the first column
+            for key, (info, rows) in result.items():
+                merged = findings.setdefault(key, (info, []))[1]
+                merged.extend({"host": target["name"], **row} for row in rows)
+        self.report(findings)
+        self.log.section("hosts", "Hosts", hosts)
+        if failed:
+            self.log.error(f"{failed} of {len(targets)} host(s) could not be audited.")
+        self.log.info("[ COMPLETED ]")
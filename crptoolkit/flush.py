@@ -0,0 +1,108 @@
+from time import monotonic, sleep
+
+def smooth(previous, current, alpha):
+    """
+    Exponentially weighted moving average
+    Returns smoothed value
+    """
+    if previous is None:
+        return current
+    return alpha * current + (1 - alpha) * previous
+
+def duration(seconds):
+    """
+    Formats seconds for log messages
+    Returns string
+    """
+    if seconds is None:
+        return "unknown"
+    if seconds < 60:
+        return f"{seconds:.1f}s"
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m{seconds:02d}s" if hours else f"{minutes}m{seconds:02d}s"
+
+class FlushMonitor:
+    """
+    Tracks the InnoDB dirty page flush and decides when waiting any longer
+    stops paying off for a slow shutdown.
+    """
+
+    COUNTERS = ["Innodb_buffer_pool_pages_dirty", "Innodb_buffer_pool_pages_flushed"]
+
+    def __init__(self, mysql, log, target = 10, timeout = 300, min_interval = 0.5, max_interval = 10, alpha = 0.3):
+        self.mysql = mysql
+        self.log = log
+        self.target = target
+        self.timeout = timeout
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.alpha = alpha
+        self.dirty = None
+        self.flush_rate = None
+        self.drain_rate = None
+        self.previous = None
+
+    def sample(self):
+        """
+        Takes a counter snapshot and updates the smoothed flush and drain rates
+        Returns current dirty page count
+        """
+        snapshot = self.mysql.status_snapshot(self.COUNTERS)
+        self.dirty = int(snapshot[1]["Innodb_buffer_pool_pages_dirty"])
+        if self.previous is not None:
+            rates = self.mysql.status_rates(self.previous, snapshot)
+            self.flush_rate = smooth(self.flush_rate, rates["Innodb_buffer_pool_pages_flushed"], self.alpha)
+            self.drain_rate = smooth(self.drain_rate, -rates["Innodb_buffer_pool_pages_dirty"], self.alpha)
+        self.previous = snapshot
+        return self.dirty
+
+    def eta(self):
+        """
+        Projects when dirty pages reach 0 at the current net drain rate (flushes minus new writes)
+        Returns seconds or None if dirty pages are not going down
+        """
+        if self.drain_rate is None or self.drain_rate <= 0:
+            return None
+        return self.dirty / self.drain_rate
+
+    def remaining_flush_time(self):
+        """
+        Projects how long a slow shutdown would spend flushing the remaining dirty pages
+        Returns seconds or None if no flush rate has been observed yet
+        """
+        if self.dirty == 0:
+            return 0.0
+        if self.flush_rate is None or self.flush_rate <= 0:
+            return None
+        return self.dirty / self.flush_rate
+
+    def interval(self):
+        """
+        Polls quickly while the rate is unknown or the flush is nearly done, backs off otherwise
+        Returns seconds
+        """
+        if (eta := self.eta()) is None:
+            return self.min_interval if self.flush_rate is None else self.max_interval
+        return min(self.max_interval, max(self.min_interval, eta / 4))
+
+    def wait(self):
+        """
+        Polls until the projected slow shutdown flush time is under target or timeout is reached
+        Returns boolean (True if the target was met)
+        """
+        deadline = monotonic() + self.timeout
+        self.sample()
+        self.log.verbose(f"Dirty pages = {self.dirty}. Waiting until the projected shutdown flush time is <= {duration(self.target)}.")
+        while True:
+            remaining = self.remaining_flush_time()
+            if remaining is not None and remaining <= self.target:
+                self.log.verbose(f"Dirty pages = {self.dirty}, projected shutdown flush time {duration(remaining)}. Continuing to prepare for shutdown.")
+                return True
+            if monotonic() >= deadline:
+                self.log.warn(f"It's been {duration(self.timeout)}. Dirty pages = {self.dirty} (projected shutdown flush time {duration(remaining)}) but continuing to prepare for shutdown.")
+                return False
+            if self.flush_rate is not None:
+                self.log.info(f"Dirty pages = {self.dirty}, flushing {self.flush_rate:.0f} pages/s, ETA {duration(self.eta())}.")
+            sleep(min(self.interval(), max(0, deadline - monotonic())))
+            self.sample()
@@ -1,30 +1,52 @@
 from time import gmtime, strftime
+from crptoolkit.output import default_output
 
 class Logger:
 
-    def __init__(self, verbose_info):
+    def __init__(self, verbose_info, output = None):
         self.verbose_info = verbose_info
+        self.output = output if output is not None else default_output()
 
     def info(self, message):
         datetime = strftime("%Y-%m-%d %H:%M:%S", gmtime())
-        print(f"{datetime} >>> {message}")
+        self.output.message(f"{datetime} >>> {message}", flush=True)
 
     def verbose(self, message):
         if self.verbose_info:
             datetime = strftime("%Y-%m-%d %H:%M:%S", gmtime())
-            print(f"{datetime} >>> {message}")
+            self.output.message(f"{datetime} >>> {message}", flush=True)
 
     def warn(self, message):
         datetime = strftime("%Y-%m-%d %H:%M:%S", gmtime())
-        print(f"{datetime} >>> [ WARNING ] {message}")
+        self.output.message(f"{datetime} >>> [ WARNING ] {message}", flush=True)
 
     def error(self, message):
         datetime = strftime("%Y-%m-%d %H:%M:%S", gmtime())
-        print(f"{datetime} >>> [ CRITICAL ] {message}")
+        self.output.message(f"{datetime} >>> [ CRITICAL ] {message}", flush=True)
         exit(1)
 
     def no_timestamp(self, message):
-        print(message)
+        self.output.message(message)
 
     def newline(self):
-        print("\n")
+        self.output.message("\n")
+
+    def rows(self, rows):
+        """
+        Renders result rows (dictionaries) in the selected output format
+        Returns number of rows
+        """
+        return self.output.rows(rows)
+
+    def section(self, name, info, rows):
+        """
+        Renders a result under an "{name}) {info}:" heading ("{info}:" when {name} is not a number),
+        followed by its row count in tsv and csv
+        Returns number of rows
+        """
+        self.newline()
+        self.no_timestamp(f"{name}) {info}:" if isinstance(name, int) else f"{info}:")
+        count = self.output.section(name, info, rows)
+        if self.output.format in ("tsv", "csv"):
+            self.no_timestamp("Empty set" if not count else "1 row in set" if count == 1 else f"{count} rows in set")
+        return count
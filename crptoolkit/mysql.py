@@ -1,9 +1,24 @@
 import pymysql.cursors
-from prettytable import PrettyTable
+from pymysql.optionfile import Parser
+from concurrent.futures import ThreadPoolExecutor
+from math import ceil
+from os.path import expanduser
+from threading import Condition
+from time import monotonic, perf_counter, sleep, time
+from crptoolkit.output import default_output
+from crptoolkit.transactions import TransactionWatcher
+
+def row_bytes(row):
+    """
+    Approximates the payload size of a row
+    Returns int
+    """
+    values = row.values() if isinstance(row, dict) else row
+    return sum(0 if value is None else len(value) if isinstance(value, (str, bytes)) else len(str(value)) for value in values)
 
 class MySQL:
 
-    def __init__(self, defaults_file, host, port, user, password, socket):
+    def __init__(self, defaults_file, host, port, user, password, socket, timeout = None, connect_timeout = None):
         self.connection = None
         self.defaults_file = defaults_file
         self.host = host
@@ -11,35 +26,106 @@ class MySQL:
         self.user = user
         self.password = password
         self.socket = socket
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.variable_ttl = 60
+        self.variable_cache = {}
+        self.status_cache = {}
+        self.hooks = []
+        self.label = None
+        self.output = default_output()
+
+    def add_hook(self, hook):
+        """
+        Registers a callable that receives one record per statement: label, statement,
+        connect/execute/fetch seconds, rows and bytes
+        """
+        self.hooks.append(hook)
+
+    def emit(self, statement, started, connect = 0.0, execute = 0.0, fetch = 0.0, rows = 0, size = 0):
+        if not self.hooks:
+            return
+        record = {
+                "time": round(started, 6),
+                "host": f"{self.host}:{self.port}" if self.defaults_file is None else self.defaults_file,
+                "label": self.label,
+                "statement": statement,
+                "connect": connect,
+                "execute": execute,
+                "fetch": fetch,
+                "rows": rows,
+                "bytes": size
+                }
+        for hook in self.hooks:
+            hook(record)
 
     def connect(self):
+        started = time()
+        start = perf_counter()
+        self.connection = self.open()
+        self.emit("CONNECT", started, connect=perf_counter() - start)
+        return self.connection
+
+    def open(self):
         if self.defaults_file is not None:
-            self.connection = pymysql.connect(
-                    read_default_file=self.defaults_file
+            return pymysql.connect(
+                    read_default_file=self.defaults_file,
+                    connect_timeout = self.connect_timeout or self.timeout or 10,
+                    read_timeout = self.timeout,
+                    write_timeout = self.timeout
                     )
-            return self.connection
         if self.socket is not None:
-            self.connection = pymysql.connect(
+            return pymysql.connect(
                     host = self.host,
                     port = self.port,
                     user = self.user,
                     password = self.password,
-                    unix_socket = self.socket
+                    unix_socket = self.socket,
+                    connect_timeout = self.connect_timeout or self.timeout or 10,
+                    read_timeout = self.timeout,
+                    write_timeout = self.timeout
                     )
-            return self.connection
-        self.connection = pymysql.connect(
+        return pymysql.connect(
                 host = self.host,
                 port = self.port,
                 user = self.user,
-                password = self.password
+                password = self.password,
+                connect_timeout = self.connect_timeout or self.timeout or 10,
+                read_timeout = self.timeout,
+                write_timeout = self.timeout
                 )
-        return self.connection
+
+    def clone(self):
+        """
+        Opens another connection with the same connection options
+        Returns MySQL
+        """
+        mysql = MySQL(self.defaults_file, self.host, self.port, self.user, self.password, self.socket, self.timeout, self.connect_timeout)
+        mysql.hooks = list(self.hooks)
+        mysql.label = self.label
+        mysql.output = self.output
+        mysql.connect()
+        return mysql
+
+    def credentials(self):
+        """
+        User and password to connect to other hosts, read from the [client] group of the
+        defaults file the same way pymysql reads it
+        Returns (user, password)
+        """
+        if self.defaults_file is None:
+            return self.user, self.password
+        parser = Parser()
+        parser.read(expanduser(self.defaults_file))
+        option = lambda name: parser.get("client", name) if parser.has_option("client", name) else None
+        return self.user or option("user"), self.password or option("password")
 
     def prettytable(self, rows):
         """
         Takes MySQL rows as tuple of dictionaries
         Returns pretty formatted table
         """
+        from prettytable import PrettyTable
         prettytable = PrettyTable(rows[0].keys())
         prettytable.align = "l"
         for row in rows:
@@ -51,43 +137,136 @@ class MySQL:
         Executes SQL and retreives result
         Returns all rows (formatted by cursor class)
         """
+        started = time()
+        start = perf_counter()
         with self.connection.cursor(cursorclass) as cursor:
             cursor.execute(sql)
+            executed = perf_counter()
             result = cursor.fetchall()
+        fetched = perf_counter()
         cursor.close()
+        if self.hooks:
+            self.emit(sql, started, execute=executed - start, fetch=fetched - executed, rows=len(result), size=sum(map(row_bytes, result)))
         if selectone:
             return False if not result else True
         if not result:
-            return "Empty set (0.00 sec)"
+            return f"Empty set ({fetched - start:.2f} sec)"
         if prettytable:
             return self.prettytable(result)
         return result
 
+    def stream_batches(self, sql, cursorclass = pymysql.cursors.SSDictCursor, batch_size = 1000):
+        """
+        Executes SQL with an unbuffered server-side cursor
+        Yields lists of at most batch_size rows (formatted by cursor class)
+        """
+        started = time()
+        start = perf_counter()
+        execute = fetch = 0.0
+        count = size = 0
+        try:
+            with self.connection.cursor(cursorclass) as cursor:
+                cursor.execute(sql)
+                execute = perf_counter() - start
+                while True:
+                    before = perf_counter()
+                    rows = cursor.fetchmany(batch_size)
+                    fetch += perf_counter() - before
+                    if not rows:
+                        break
+                    count += len(rows)
+                    if self.hooks:
+                        size += sum(map(row_bytes, rows))
+                    yield rows
+        finally:
+            self.emit(sql, started, execute=execute, fetch=fetch, rows=count, size=size)
+
+    def stream_query(self, sql, cursorclass = pymysql.cursors.SSDictCursor, batch_size = 1000):
+        """
+        Executes SQL with an unbuffered server-side cursor
+        Yields one row at a time (formatted by cursor class)
+        """
+        for rows in self.stream_batches(sql, cursorclass, batch_size):
+            yield from rows
+
+    def fetch_variables(self, table, variable_names):
+        """
+        Reads variables from performance_schema.{table} in a single round-trip
+        Returns dictionary of lowercase variable name to value (None if it does not exist)
+        """
+        names = ", ".join(f"'{variable_name}'" for variable_name in variable_names)
+        sql = f"SELECT VARIABLE_NAME, VARIABLE_VALUE FROM performance_schema.{table} WHERE VARIABLE_NAME IN ({names})"
+        result = {variable_name.lower(): None for variable_name in variable_names}
+        for variable_name, variable_value in self.stream_query(sql, cursorclass=pymysql.cursors.SSCursor):
+            result[variable_name.lower()] = variable_value
+        return result
+
+    def cached_variables(self, table, cache, variable_names, ttl):
+        """
+        Serves variables from cache, fetching every missing or expired one in one round-trip
+        Returns dictionary of variable name to value
+        """
+        now = monotonic()
+        expired = [variable_name for variable_name in variable_names if variable_name.lower() not in cache or now - cache[variable_name.lower()][1] >= ttl]
+        if expired:
+            for variable_name, variable_value in self.fetch_variables(table, expired).items():
+                cache[variable_name] = (variable_value, now)
+        return {variable_name: cache[variable_name.lower()][0] for variable_name in variable_names}
+
+    def get_variables(self, variable_names, ttl = None):
+        """
+        Gets values of several MySQL variables, cached for {ttl} seconds (default: variable_ttl)
+        Returns dictionary of variable name to value
+        """
+        return self.cached_variables("global_variables", self.variable_cache, variable_names, self.variable_ttl if ttl is None else ttl)
+
     def get_variable(self, variable_name):
         """
         Gets value of a MySQL variable
         Returns value
         """
-        sql = f"SHOW GLOBAL VARIABLES WHERE VARIABLE_NAME = '{variable_name}'"
-        result = self.run_query(sql)
-        return result[0]['Value']
+        return self.get_variables([variable_name])[variable_name]
 
     def set_variable(self, variable_name, variable_value):
         """
-        Sets value of a MySQL variable
+        Sets value of a MySQL variable and invalidates its cached value
         Returns boolean
         """
         sql = f"SET GLOBAL {variable_name} = {variable_value}"
         self.run_query(sql)
+        self.variable_cache.pop(variable_name.lower(), None)
+
+    def get_status_variables(self, variable_names, ttl = 0):
+        """
+        Gets values of several MySQL status variables, cached for {ttl} seconds (default: always fresh)
+        Returns dictionary of variable name to value
+        """
+        return self.cached_variables("global_status", self.status_cache, variable_names, ttl)
 
     def get_status_variable(self, variable_name):
         """
         Gets value of a MySQL status variable
         Returns value
         """
-        sql = f"SHOW GLOBAL STATUS WHERE VARIABLE_NAME = '{variable_name}'"
-        result = self.run_query(sql)
-        return result[0]['Value']
+        return self.get_status_variables([variable_name])[variable_name]
+
+    def status_snapshot(self, variable_names):
+        """
+        Takes a snapshot of numeric status counters
+        Returns (monotonic time, dictionary of variable name to number)
+        """
+        values = self.get_status_variables(variable_names)
+        return monotonic(), {variable_name: float(value) for variable_name, value in values.items() if value is not None}
+
+    def status_rates(self, before, after):
+        """
+        Diffs two status snapshots
+        Returns dictionary of variable name to change per second
+        """
+        elapsed = after[0] - before[0]
+        if elapsed <= 0:
+            return {variable_name: 0.0 for variable_name in after[1]}
+        return {variable_name: (value - before[1][variable_name]) / elapsed for variable_name, value in after[1].items() if variable_name in before[1]}
 
     def is_replica(self):
         """
@@ -95,31 +274,76 @@ class MySQL:
         Returns boolean
         """
         sql = "SHOW SLAVE STATUS"
-        if not self.run_query(sql):
-            return False
-        return True
+        return self.run_query(sql, selectone=True)
 
     def replica_status(self):
-        print('hi')
-
-    def stop_replication(self):
+        """
+        Gets show slave status
+        Returns dictionary or None if this is not a replica
+        """
         sql = "SHOW SLAVE STATUS"
         result = self.run_query(sql)
-        if (slave_io_running := result["Slave_IO_Running"]) == "Yes":
+        if type(result) == str:
+            return None
+        return result[0]
+
+    def wait_for_applier(self, status, log, timeout):
+        """
+        Waits for the SQL thread to apply everything the IO thread received (GTID set or
+        source position from {status}) and for any parallel workers to drain
+        Returns boolean (False if it did not catch up within {timeout} seconds)
+        """
+        deadline = monotonic() + timeout
+        retrieved_gtid_set = (status.get("Retrieved_Gtid_Set") or "").replace("\n", "")
+        # ON_PERMISSIVE replicas also receive GTIDs, only OFF and OFF_PERMISSIVE need the source position
+        if retrieved_gtid_set and self.get_variable("gtid_mode") in ("ON", "ON_PERMISSIVE"):
+            log.verbose(f"Waiting up to {timeout} seconds for the SQL thread to execute GTID set {retrieved_gtid_set}.")
+            sql = f"SELECT WAIT_FOR_EXECUTED_GTID_SET('{retrieved_gtid_set}', {ceil(timeout)}) result"
+            if self.run_query(sql)[0]["result"] != 0:
+                return False
+        elif status["Relay_Master_Log_File"] != status["Master_Log_File"] or status["Exec_Master_Log_Pos"] != status["Read_Master_Log_Pos"]:
+            log.verbose(f"Waiting up to {timeout} seconds for the SQL thread to reach {status['Master_Log_File']}:{status['Read_Master_Log_Pos']}.")
+            sql = f"SELECT MASTER_POS_WAIT('{status['Master_Log_File']}', {status['Read_Master_Log_Pos']}, {ceil(timeout)}) result"
+            if (result := self.run_query(sql)[0]["result"]) is None or result < 0:
+                return False
+        else:
+            log.verbose("The SQL thread has already applied everything that was received.")
+        if int(self.get_variable("slave_parallel_workers") or 0) == 0:
+            return True
+        log.verbose("Waiting for the parallel workers to drain.")
+        sql = "SELECT COUNT(*) busy FROM performance_schema.threads WHERE NAME IN ('thread/sql/slave_worker', 'thread/sql/replica_worker') AND PROCESSLIST_STATE NOT LIKE 'Waiting for an event from Coordinator'"
+        while self.run_query(sql)[0]["busy"] > 0:
+            if monotonic() >= deadline:
+                return False
+            sleep(0.1)
+        return True
+
+    def stop_replication(self, log, timeout = 60):
+        """
+        Stops the IO thread, waits for the applier to catch up, then stops the SQL thread
+        Returns boolean (False if the applier did not catch up within {timeout} seconds)
+        """
+        status = self.replica_status()
+        slave_io_running = status["Slave_IO_Running"]
+        slave_sql_running = status["Slave_SQL_Running"]
+        if slave_io_running == "Yes":
+            log.verbose("Stopping IO thread.")
             sql = "STOP SLAVE IO_THREAD"
             self.run_query(sql)
+            status = self.replica_status()
         else:
-            verbose("IO thread was already stopped.")
-        if (slave_sql_running := result["Slave_SQL_Running"]) == "Yes":
-            verbose("Giving the SQL thread 10 seconds to catch up.")
-            sleep(10)
-            verbose("Stopping SQL thread.")
-            sql = "STOP SLAVE SQL_thread"
+            log.verbose("IO thread was already stopped.")
+        if slave_sql_running == "Yes":
+            if not self.wait_for_applier(status, log, timeout):
+                return False
+            log.verbose("Stopping SQL thread.")
+            sql = "STOP SLAVE SQL_THREAD"
             self.run_query(sql)
         else:
-            verbose("SQL thread was already stopped.")
+            log.verbose("SQL thread was already stopped.")
         if slave_io_running == "No" and slave_sql_running == "No":
-            warn("Replication was already stopped.")
+            log.warn("Replication was already stopped.")
+        return True
 
     def start_replication(self):
         sql = ("START SLAVE")
@@ -128,15 +352,83 @@ class MySQL:
 
     def get_transactions(self, duration):
         """
-        Gets MySQL transactions running > {duration} seconds
-        Returns pretty printed table
+        Gets MySQL transactions running > {duration} seconds and renders them to the output.
+        Uses performance_schema and falls back to innodb_trx and the processlist when
+        transaction events are not collected for every transaction.
+        Returns True if any were found
         """
-        sql = f"SELECT trx_id, trx_started, (NOW() - trx_started) trx_duration_seconds, id processlist_id, user, IF(LEFT(HOST, (LOCATE(':', host) - 1)) = '', host, LEFT(HOST, (LOCATE(':', host) - 1))) host, command, time, REPLACE(SUBSTRING(info,1,25),'\n','') info_25 FROM information_schema.innodb_trx JOIN information_schema.processlist ON innodb_trx.trx_mysql_thread_id = processlist.id WHERE (NOW() - trx_started) > {duration} ORDER BY trx_started"
-        if not (result := self.run_query(sql)):
-            return False
+        watcher = TransactionWatcher(self, duration)
+        if watcher.available():
+            result = list(watcher.sample().values())
         else:
-            table = PrettyTable(result[0].keys(), align = "l")
-            for rows in result:
-                table.add_row(list(rows.values()))
-            print(table)
-            return True
+            sql = f"SELECT trx_id, trx_started, TIMESTAMPDIFF(SECOND, trx_started, NOW()) trx_duration_seconds, id processlist_id, user, IF(LEFT(HOST, (LOCATE(':', host) - 1)) = '', host, LEFT(HOST, (LOCATE(':', host) - 1))) host, command, time, REPLACE(SUBSTRING(info,1,25),'\n','') info_25 FROM information_schema.innodb_trx JOIN information_schema.processlist ON innodb_trx.trx_mysql_thread_id = processlist.id WHERE trx_started < NOW() - INTERVAL {duration} SECOND ORDER BY trx_started"
+            result = self.run_query(sql)
+        if type(result) != list or not result:
+            return False
+        self.output.rows(result)
+        return True
+
+class ConnectionPool:
+    """
+    Bounded pool of at most {size} connections cloned from {mysql} (never {mysql} itself, so the
+    caller can keep using it) and a thread pool of the same size to run queries on them.
+    Connections are opened on first use.
+    """
+
+    def __init__(self, mysql, size):
+        self.mysql = mysql
+        self.size = max(1, size)
+        self.idle = []
+        self.opened = 0
+        self.condition = Condition()
+        self.executor = ThreadPoolExecutor(max_workers=self.size)
+
+    def acquire(self):
+        with self.condition:
+            while not self.idle and self.opened >= self.size:
+                self.condition.wait()
+            if self.idle:
+                return self.idle.pop()
+            self.opened += 1
+        try:
+            return self.mysql.clone()
+        except Exception:
+            with self.condition:
+                self.opened -= 1
+                self.condition.notify()
+            raise
+
+    def release(self, mysql):
+        with self.condition:
+            self.idle.append(mysql)
+            self.condition.notify()
+
+    def call(self, function):
+        mysql = self.acquire()
+        try:
+            return function(mysql)
+        finally:
+            self.release(mysql)
+
+    def submit(self, function):
+        """
+        Runs function(mysql) on a pooled connection
+        Returns Future
+        """
+        return self.executor.submit(self.call, function)
+
+    def run(self, jobs):
+        """
+        Starts every {key: function(mysql)} job at once (at most {size} running)
+        Yields (key, result) in the order of {jobs}, each as soon as it is done
+        """
+        futures = {key: self.submit(function) for key, function in jobs.items()}
+        return ((key, future.result()) for key, future in futures.items())
+
+    def close(self):
+        self.executor.shutdown()
+        with self.condition:
+            for mysql in self.idle:
+                mysql.connection.close()
+            self.idle = []
+            self.opened = 0
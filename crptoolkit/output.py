@@ -0,0 +1,192 @@
+import atexit
+import csv
+import json
+import sys
+from itertools import chain, islice
+from threading import Lock
+
+FORMATS = ["table", "tsv", "csv", "jsonl"]
+
+class TableRenderer:
+    """
+    Aligned table for small results. Results over {limit} rows fall back to TSV
+    so a huge table is never built in memory.
+    """
+
+    def __init__(self, output, limit = 1000):
+        self.output = output
+        self.limit = limit
+
+    def render(self, rows):
+        buffered = list(islice(rows, self.limit + 1))
+        if not buffered:
+            self.output.line("Empty set")
+            return 0
+        if len(buffered) > self.limit:
+            self.output.line(f"More than {self.limit} rows, printing tab separated values instead of a table.")
+            return TsvRenderer(self.output).render(chain(buffered, rows))
+        from prettytable import PrettyTable
+        table = PrettyTable(list(buffered[0].keys()))
+        table.align = "l"
+        for row in buffered:
+            table.add_row(list(row.values()))
+        self.output.line(table)
+        return len(buffered)
+
+class TsvRenderer:
+    """
+    Header line then one line per row, escaped like the mysql client's batch mode.
+    """
+
+    def __init__(self, output):
+        self.output = output
+
+    def field(self, value):
+        if value is None:
+            return "NULL"
+        return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n")
+
+    def render(self, rows):
+        count = 0
+        for row in rows:
+            if count == 0:
+                self.output.write("\t".join(map(self.field, row.keys())) + "\n")
+            self.output.write("\t".join(map(self.field, row.values())) + "\n")
+            count += 1
+        return count
+
+class CsvRenderer:
+
+    def __init__(self, output):
+        self.output = output
+
+    def render(self, rows):
+        writer = csv.writer(self.output, lineterminator="\n")
+        count = 0
+        for row in rows:
+            if count == 0:
+                writer.writerow(row.keys())
+            writer.writerow(["" if value is None else value for value in row.values()])
+            count += 1
+        return count
+
+class JsonLinesRenderer:
+
+    def __init__(self, output):
+        self.output = output
+
+    def render(self, rows):
+        count = 0
+        for row in rows:
+            self.output.write(json.dumps(row, default=str) + "\n")
+            count += 1
+        return count
+
+RENDERERS = {
+        "table": TableRenderer,
+        "tsv": TsvRenderer,
+        "csv": CsvRenderer,
+        "jsonl": JsonLinesRenderer
+        }
+
+# Outputs writing to sys.stdout (one per tool run), flushed by a single exit hook. Outputs
+# to other streams, like a fleet host's buffer, are flushed by their owner and not kept alive.
+stdout_outputs = []
+
+def flush_stdout_outputs():
+    for output in list(stdout_outputs):
+        output.flush()
+
+atexit.register(flush_stdout_outputs)
+
+class Output:
+    """
+    Buffered writer shared by Logger and MySQL. Result rows are rendered one at a
+    time in the selected format and written in {buffer_size} chunks.
+    Except in table format, log lines and headings go to {messages} (stderr) so the
+    stream only carries rows.
+    """
+
+    def __init__(self, format = "table", stream = None, buffer_size = 65536, messages = None):
+        if format not in RENDERERS:
+            raise ValueError(f"Unknown output format: {format}")
+        self.format = format
+        self.stream = stream
+        self.messages = messages
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.size = 0
+        self.lock = Lock()
+        if stream is None:
+            stdout_outputs.append(self)
+
+    def write(self, text):
+        with self.lock:
+            self.buffer.append(text)
+            self.size += len(text)
+            full = self.size >= self.buffer_size
+        if full:
+            self.flush()
+
+    def line(self, message, flush = False):
+        self.write(f"{message}\n")
+        if flush:
+            self.flush()
+
+    def message(self, message, flush = False):
+        """
+        Writes a log line or heading next to the rows in table format, apart from them otherwise
+        """
+        if self.format == "table":
+            self.line(message, flush)
+            return
+        # Rows written so far go out first so a terminal shows both in order
+        self.flush()
+        messages = self.messages if self.messages is not None else sys.stderr
+        messages.write(f"{message}\n")
+        messages.flush()
+
+    def flush(self):
+        with self.lock:
+            text = "".join(self.buffer)
+            self.buffer = []
+            self.size = 0
+        # sys.stdout is looked up on every flush so redirection keeps working
+        stream = self.stream if self.stream is not None else sys.stdout
+        if text:
+            stream.write(text)
+        stream.flush()
+
+    def rows(self, rows):
+        """
+        Renders an iterable of dictionaries in the selected format
+        Returns number of rows
+        """
+        return RENDERERS[self.format](self).render(iter(rows))
+
+    def section(self, name, info, rows):
+        """
+        Renders the rows of one named result (a numbered check or a report). Except in table
+        format every row is tagged with {name}. In jsonl the section ends with a
+        {check, info, rows} record, so an empty result is told apart from a skipped one
+        (in tsv and csv a record would break the table, Logger prints the row count instead).
+        Returns number of rows
+        """
+        if self.format == "table":
+            return self.rows(rows)
+        count = self.rows({"check": name, **row} for row in rows)
+        if self.format == "jsonl":
+            self.rows([{"check": name, "info": info, "rows": count}])
+        return count
+
+shared = None
+
+def default_output():
+    """
+    Output used when none is passed explicitly
+    Returns Output
+    """
+    global shared
+    if shared is None:
+        shared = Output()
+    return shared
@@ -0,0 +1,171 @@
+import pymysql.cursors
+from time import monotonic, sleep
+from crptoolkit.flush import duration, smooth
+
+class ShutdownReadiness:
+    """
+    Samples the work a slow shutdown (innodb_fast_shutdown = 0) still has to do, all in one
+    round-trip per tick: dirty pages, the undo history list, the change buffer, the redo
+    checkpoint age and the active transactions. Projects the shutdown time from the smoothed
+    rates each one drains at, and waits until it is under {budget} seconds.
+    """
+
+    STATUS = ["Innodb_buffer_pool_pages_dirty", "Innodb_buffer_pool_pages_flushed"]
+    METRICS = ["trx_rseg_history_len", "trx_commits_insert_update", "purge_undolog_pages", "ibuf_size", "ibuf_merges", "log_lsn_checkpoint_age"]
+
+    def __init__(self, mysql, log, budget = 60, timeout = 300, min_interval = 0.5, max_interval = 10, alpha = 0.3):
+        self.mysql = mysql
+        self.log = log
+        self.budget = budget
+        self.timeout = timeout
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.alpha = alpha
+        self.values = {}
+        self.rates = {}
+        self.latest = {}
+        self.previous = None
+
+    def query(self):
+        """
+        Every signal as (name, value) rows of one UNION, so a tick costs a single round-trip.
+        Disabled innodb_metrics counters are left out rather than read as 0.
+        Returns SQL
+        """
+        status = ", ".join(f"'{name}'" for name in self.STATUS)
+        metrics = ", ".join(f"'{name}'" for name in self.METRICS)
+        return (f"SELECT VARIABLE_NAME AS name, VARIABLE_VALUE AS value FROM performance_schema.global_status WHERE VARIABLE_NAME IN ({status}) "
+                f"UNION ALL SELECT NAME, COUNT FROM information_schema.innodb_metrics WHERE NAME IN ({metrics}) AND STATUS = 'enabled' "
+                "UNION ALL SELECT 'active_transactions', COUNT(*) FROM performance_schema.events_transactions_current WHERE STATE = 'ACTIVE'")
+
+    def sample(self):
+        """
+        Takes a snapshot of every signal and updates the smoothed rates
+        Returns dictionary of signal name to value
+        """
+        snapshot = monotonic(), {name: float(value) for name, value in self.mysql.stream_query(self.query(), pymysql.cursors.SSCursor) if value is not None}
+        if self.previous is not None:
+            self.latest = self.mysql.status_rates(self.previous, snapshot)
+            for name, rate in self.latest.items():
+                self.rates[name] = smooth(self.rates.get(name), rate, self.alpha)
+        self.values = snapshot[1]
+        self.previous = snapshot
+        return self.values
+
+    def remaining(self, backlog, rate):
+        """
+        Seconds to work through {backlog} at {rate} per second
+        Returns seconds or None if the signal is missing or not draining
+        """
+        if (value := self.values.get(backlog)) is None:
+            return None
+        if value <= 0:
+            return 0.0
+        if rate is None or rate <= 0:
+            return None
+        return value / rate
+
+    def purge_rate(self):
+        """
+        History list entries purged per second, at most. Committed read-write transactions add to
+        the list while purge removes from it, so the throughput is at most the commit rate minus the
+        list's growth (insert-only commits are counted but add nothing to the list).
+        Without trx_commits_insert_update, only the net shrinkage is known.
+        Returns rate or None before the second sample or while purge is stalled
+        """
+        if "trx_rseg_history_len" not in self.rates or self.purge_stalled():
+            return None
+        return self.rates.get("trx_commits_insert_update", 0) - self.rates["trx_rseg_history_len"]
+
+    def purge_stalled(self):
+        """
+        Purge is stalled (an old read view holds it back, for instance) when it removed no undo log
+        pages since the last sample or, without purge_undolog_pages, when the history list did not shrink
+        Returns boolean
+        """
+        if self.values.get("trx_rseg_history_len", 0) <= 0 or "trx_rseg_history_len" not in self.latest:
+            return False
+        if "purge_undolog_pages" in self.latest:
+            return self.latest["purge_undolog_pages"] <= 0
+        return self.latest["trx_rseg_history_len"] >= 0
+
+    def stages(self):
+        """
+        Projects each part of a slow shutdown. Purge and the change buffer merge are measured by
+        their throughput while the server still takes writes (the change buffer falls back to how
+        fast it shrinks). The final checkpoint writes out the dirty pages, so the checkpoint age
+        is covered by the flush.
+        Returns dictionary of stage to seconds (None if unknown, absent if not collected)
+        """
+        stages = {"flush": self.remaining("Innodb_buffer_pool_pages_dirty", self.rates.get("Innodb_buffer_pool_pages_flushed"))}
+        if "trx_rseg_history_len" in self.values:
+            stages["purge"] = self.remaining("trx_rseg_history_len", self.purge_rate())
+        if "ibuf_size" in self.values:
+            merge_rate = max(self.rates.get("ibuf_merges", 0), -self.rates.get("ibuf_size", 0))
+            stages["change buffer"] = self.remaining("ibuf_size", merge_rate)
+        return stages
+
+    def predict(self):
+        """
+        Shutdown runs purge, the change buffer merge and the final flush one after another
+        Returns seconds or None if any stage is unknown
+        """
+        stages = self.stages().values()
+        return None if None in stages else sum(stages)
+
+    def projection(self, stage, seconds):
+        return "stalled" if stage == "purge" and self.purge_stalled() else duration(seconds)
+
+    def dashboard(self):
+        """
+        One row per signal with its value, how fast it drains and its projected seconds
+        Returns list of dictionaries
+        """
+        stages = self.stages()
+        rate = lambda name, sign = 1: None if name not in self.rates else round(sign * self.rates[name], 1)
+        purge_rate = None if (purge_rate := self.purge_rate()) is None else round(purge_rate, 1)
+        signals = [
+                ("dirty pages", "Innodb_buffer_pool_pages_dirty", rate("Innodb_buffer_pool_pages_flushed"), "flush"),
+                ("history list length", "trx_rseg_history_len", 0.0 if self.purge_stalled() else purge_rate, "purge"),
+                ("change buffer pages", "ibuf_size", rate("ibuf_merges"), "change buffer"),
+                ("checkpoint age (bytes)", "log_lsn_checkpoint_age", rate("log_lsn_checkpoint_age", -1), None),
+                ("active transactions", "active_transactions", None, None)
+                ]
+        rows = [{"signal": signal, "value": int(self.values[name]), "drain_per_second": drain, "projected": self.projection(stage, stages[stage]) if stage in stages else ""}
+                for signal, name, drain, stage in signals if name in self.values]
+        rows.append({"signal": "slow shutdown", "value": None, "drain_per_second": None, "projected": duration(self.predict())})
+        return rows
+
+    def interval(self):
+        """
+        Polls quickly until every rate is known or the projection is near the budget, backs off otherwise
+        Returns seconds
+        """
+        if (predicted := self.predict()) is None:
+            return self.min_interval if not self.rates else self.max_interval
+        return min(self.max_interval, max(self.min_interval, (predicted - self.budget) / 4))
+
+    def wait(self):
+        """
+        Polls until the projected slow shutdown time is under budget or timeout is reached
+        Returns boolean (True if the budget was met)
+        """
+        deadline = monotonic() + self.timeout
+        self.sample()
+        self.log.verbose(f"Waiting until the projected slow shutdown time is <= {duration(self.budget)}.")
+        while True:
+            predicted = self.predict() if self.rates else None
+            if predicted is not None and predicted <= self.budget:
+                self.log.rows(self.dashboard())
+                self.log.info(f"Projected slow shutdown time {duration(predicted)}. Continuing to prepare for shutdown.")
+                return True
+            if monotonic() >= deadline:
+                self.log.rows(self.dashboard())
+                self.log.warn(f"It's been {duration(self.timeout)}. Projected slow shutdown time is {duration(predicted)} but continuing to prepare for shutdown.")
+                return False
+            if self.rates:
+                parts = ", ".join(f"{stage} {self.projection(stage, seconds)}" for stage, seconds in self.stages().items())
+                active = int(self.values.get("active_transactions", 0))
+                self.log.info(f"Projected slow shutdown time {duration(predicted)} ({parts}), {active} active transaction(s).")
+            sleep(min(self.interval(), max(0, deadline - monotonic())))
+            self.sample()
@@ -0,0 +1,282 @@
+import os
+import shlex
+import subprocess
+from pymysql.err import MySQLError
+from threading import Lock
+from time import localtime, monotonic, sleep, strftime, time
+from crptoolkit.args import ArgParser
+from crptoolkit.common import read_snapshot, save_snapshot
+from crptoolkit.fleet import HostError, HostLogger, connect, read_inventory, run_fleet
+from crptoolkit.flush import duration
+from crptoolkit.logger import Logger
+from crptoolkit.output import Output
+from crptoolkit.shutdown import MySQLPrepareShutdown
+
+VERSION = 1
+# Checkpoint statuses of hosts this tool already took out of service
+OUT_OF_SERVICE = ("prepared", "restarted")
+
+def group_of(target):
+    """
+    The first inventory tag names the replication group, an untagged host is a group of its own
+    Returns string
+    """
+    return target["tags"][0] if target["tags"] else target["name"]
+
+def replica_health(mysql, max_lag):
+    """
+    Checks that a replica is serving: both replication threads running and lag under {max_lag}
+    Returns (state, reason), state is "serving", "unhealthy" or "not a replica"
+    """
+    status = mysql.replica_status()
+    if status is None:
+        return "not a replica", "SHOW SLAVE STATUS is empty"
+    if status["Slave_IO_Running"] != "Yes" or status["Slave_SQL_Running"] != "Yes":
+        return "unhealthy", f"replication stopped (IO {status['Slave_IO_Running']}, SQL {status['Slave_SQL_Running']})"
+    if (lag := status["Seconds_Behind_Master"]) is None or lag > max_lag:
+        return "unhealthy", f"lagging {lag} seconds"
+    return "serving", f"lagging {lag} seconds"
+
+def plan_wave(pending, states, out, groups, concurrency, min_healthy):
+    """
+    Picks up to {concurrency} of the {pending} targets so every replication group keeps at least
+    {min_healthy} serving replicas. Hosts in {out} (prepared or restarted before a resume) are
+    already out of service and go first without any check. Other hosts are only taken while
+    serving: an unhealthy replica still takes traffic, it waits until it serves again.
+    Returns list of targets
+    """
+    left = {group: sum(1 for target in members if states.get(target["name"]) == "serving") for group, members in groups.items()}
+    wave = [target for target in pending if target["name"] in out][:concurrency]
+    for target in pending:
+        if len(wave) >= concurrency:
+            break
+        group = group_of(target)
+        if target["name"] in out or states.get(target["name"]) != "serving" or left[group] - 1 < min_healthy:
+            continue
+        left[group] -= 1
+        wave.append(target)
+    return wave
+
+class RolloutState:
+    """
+    Per-host progress of a rolling shutdown, checkpointed to {path} as JSON after every change
+    (replaced atomically) so an interrupted or failed rollout resumes where it stopped.
+    """
+
+    def __init__(self, path, targets):
+        self.path = path
+        self.lock = Lock()
+        self.waves = 0
+        self.hosts = {target["name"]: {"status": "pending", "wave": None, "prepared": None, "message": ""} for target in targets}
+        if path is not None and os.path.exists(path):
+            if (snapshot := read_snapshot(path, VERSION)) is not None:
+                self.waves = snapshot["waves"]
+                for name, host in snapshot["hosts"].items():
+                    if name in self.hosts:
+                        self.hosts[name] = host
+
+    def status(self, name):
+        return self.hosts[name]["status"]
+
+    def update(self, name, status, **fields):
+        """
+        Records a host's new status and checkpoints
+        """
+        with self.lock:
+            self.hosts[name].update(status=status, **fields)
+            self.save()
+
+    def start_wave(self, targets):
+        with self.lock:
+            self.waves += 1
+            for target in targets:
+                self.hosts[target["name"]]["wave"] = self.waves
+            self.save()
+        return self.waves
+
+    def save(self):
+        if self.path is None:
+            return
+        save_snapshot(self.path, VERSION, {"waves": self.waves, "hosts": self.hosts}, indent=1)
+
+class MySQLRollingShutdown:
+
+    def __init__(self, args):
+        self.args = args
+        self.inventory = args.inventory
+        self.state_file = args.state
+        self.concurrency = args.concurrency
+        self.min_healthy = args.min_healthy
+        self.max_lag = args.max_lag
+        self.restart_command = args.restart_command
+        self.restart_timeout = args.restart_timeout
+        self.catchup_timeout = args.catchup_timeout
+        self.health_timeout = args.health_timeout
+        self.interval = args.interval
+        self.timeout = args.timeout
+        self.verbose = args.verbose
+        _, _, _, self.user, self.password, _ = ArgParser(args).connect()
+        self.format = args.format
+        self.log = Logger(self.verbose, Output(self.format))
+        self.lock = Lock()
+        self.state = None
+
+    def health(self, target):
+        """
+        Returns (state, reason) for one host, see replica_health(), or "unreachable"
+        """
+        try:
+            mysql = connect(target, self.user, self.password, self.timeout)
+        except MySQLError as e:
+            return "unreachable", str(e)
+        try:
+            return replica_health(mysql, self.max_lag)
+        finally:
+            mysql.connection.close()
+
+    def probe(self, targets):
+        """
+        Checks every host of {targets} at once
+        Returns dictionary of host name to (state, reason)
+        """
+        states = {}
+        for target, result, error, _ in run_fleet(targets, self.health, min(len(targets), 32)):
+            states[target["name"]] = result if error is None else ("unreachable", str(error))
+            self.log.verbose(f"{target['name']}: {', '.join(states[target['name']])}.")
+        return states
+
+    def prepare(self, target, log):
+        mysql = connect(target, self.user, self.password)
+        try:
+            MySQLPrepareShutdown(self.args, mysql, log).run()
+        finally:
+            mysql.connection.close()
+
+    def restart(self, target):
+        command = self.restart_command.format(name=target["name"], host=target["host"] or "", port=target["port"] or "")
+        try:
+            subprocess.run(shlex.split(command), check=True, capture_output=True, text=True, timeout=self.restart_timeout)
+        except subprocess.CalledProcessError as e:
+            raise HostError(f"`{command}` exited with {e.returncode}: {e.stderr.strip()}")
+        except subprocess.TimeoutExpired:
+            raise HostError(f"`{command}` did not finish within {duration(self.restart_timeout)}")
+
+    def wait_for_restart(self, target, prepared):
+        """
+        Polls until the host answers with an uptime shorter than the time since it was prepared
+        """
+        deadline = monotonic() + self.restart_timeout
+        while monotonic() < deadline:
+            try:
+                mysql = connect(target, self.user, self.password, self.timeout)
+                try:
+                    if int(mysql.get_status_variable("Uptime")) < time() - prepared:
+                        return
+                finally:
+                    mysql.connection.close()
+            except MySQLError:
+                pass
+            sleep(self.interval)
+        raise HostError(f"Not restarted within {duration(self.restart_timeout)}")
+
+    def wait_for_catchup(self, target):
+        deadline = monotonic() + self.catchup_timeout
+        reason = "unknown"
+        while monotonic() < deadline:
+            state, reason = self.health(target)
+            if state == "serving":
+                return
+            if state == "not a replica":
+                raise HostError(f"Not a replica after the restart ({reason})")
+            sleep(self.interval)
+        raise HostError(f"Not caught up within {duration(self.catchup_timeout)} ({reason})")
+
+    def roll(self, target):
+        """
+        Prepares, restarts and waits for one host, checkpointing each step
+        (after a resume, a host is not prepared or restarted again)
+        Returns list of (level, message) from the prepare flow
+        """
+        name = target["name"]
+        log = HostLogger(name, self.verbose, self.format)
+        try:
+            if self.state.status(name) in ("pending", "failed"):
+                self.prepare(target, log)
+                self.state.update(name, "prepared", prepared=time(), message="")
+            if self.state.status(name) == "prepared":
+                if self.restart_command:
+                    self.restart(target)
+                self.wait_for_restart(target, self.state.hosts[name]["prepared"])
+                self.state.update(name, "restarted")
+            self.wait_for_catchup(target)
+            self.state.update(name, "done")
+        except (Exception, SystemExit) as e:
+            # A host that failed to prepare reverted itself, a prepared or restarted one keeps its
+            # status so a resume picks up from there
+            status = self.state.status(name)
+            self.state.update(name, "failed" if status == "pending" else status, message=str(e) or type(e).__name__)
+            raise
+        finally:
+            # One host's messages and rows are written together
+            with self.lock:
+                for level, message in log.collect():
+                    if level == "rows":
+                        self.log.output.write(message)
+                    elif level in ("warning", "critical"):
+                        self.log.warn(f"{name}: {message}")
+                    else:
+                        self.log.verbose(f"{name}: {message}")
+                self.log.output.flush()
+        return log.messages
+
+    def run(self):
+        targets = read_inventory(self.inventory)
+        groups = {}
+        for target in targets:
+            groups.setdefault(group_of(target), []).append(target)
+        if (small := [group for group, members in groups.items() if len(members) <= self.min_healthy]):
+            self.log.error(f"Replication group(s) {', '.join(small)} have no more than {self.min_healthy} host(s) in the inventory, so none can be taken out. Add their replicas or lower --min-healthy.")
+        self.state = RolloutState(self.state_file, targets)
+        if (done := sum(1 for host in self.state.hosts.values() if host["status"] == "done")):
+            self.log.info(f"Resuming from {self.state_file}: {done} of {len(targets)} host(s) are done.")
+        self.log.info(f"[ START ] Rolling shutdown preparation of {len(targets)} host(s) in {len(groups)} replication group(s), {self.concurrency} at a time.")
+        pending = [target for target in targets if self.state.status(target["name"]) != "done"]
+        while pending:
+            # Only the groups with pending hosts decide the next wave
+            members = {group: groups[group] for group in {group_of(target) for target in pending}}
+            waited = monotonic()
+            while True:
+                states = self.probe([target for group in members.values() for target in group])
+                out = {target["name"] for target in pending if self.state.status(target["name"]) in OUT_OF_SERVICE}
+                if (primaries := [f"{target['name']} ({states[target['name']][1]})" for target in pending if target["name"] not in out and states[target["name"]][0] == "not a replica"]):
+                    self.report()
+                    self.log.error(f"Not a replica: {', '.join(primaries)}. Only replicas can be rolled, remove them from the inventory.")
+                if (wave := plan_wave(pending, {name: state for name, (state, _) in states.items()}, out, members, self.concurrency, self.min_healthy)):
+                    break
+                unhealthy = [f"{target['name']} ({', '.join(states[target['name']])})" for target in pending if target["name"] not in out and states[target["name"]][0] != "serving"]
+                if monotonic() - waited >= self.health_timeout:
+                    self.report()
+                    blocked = f" Pending host(s) that are not serving: {', '.join(unhealthy)}." if unhealthy else ""
+                    self.log.error(f"No host could be taken out for {duration(self.health_timeout)} without dropping a replication group under {self.min_healthy} serving replica(s).{blocked}")
+                self.log.info(f"Waiting for enough serving replicas to start the next wave{' (not serving: ' + ', '.join(unhealthy) + ')' if unhealthy else ''}.")
+                sleep(self.interval)
+            number = self.state.start_wave(wave)
+            self.log.info(f"Wave {number}: {', '.join(target['name'] for target in wave)}.")
+            failed = 0
+            for target, _, error, seconds in run_fleet(wave, self.roll, self.concurrency):
+                if error is not None:
+                    failed += 1
+                    self.log.warn(f"{target['name']} failed after {duration(seconds)}: {error}")
+                    continue
+                self.log.info(f"{target['name']} is back and caught up after {duration(seconds)}.")
+            if failed:
+                self.report()
+                resume = f" Fix them and rerun with --state {self.state_file} to resume." if self.state_file else ""
+                self.log.error(f"Wave {number} failed for {failed} of {len(wave)} host(s). Stopped before the next wave.{resume}")
+            pending = [target for target in pending if target not in wave]
+        self.report()
+        self.log.info("[ COMPLETED ] Every host was prepared, restarted and caught up.")
+
+    def report(self):
+        rows = ({"host": name, **host, "prepared": strftime("%Y-%m-%d %H:%M:%S", localtime(host["prepared"])) if host["prepared"] else None} for name, host in self.state.hosts.items())
+        self.log.section("hosts", "Hosts", rows)
@@ -0,0 +1,327 @@
+import pymysql.cursors
+from pymysql.err import MySQLError
+from time import monotonic
+from crptoolkit.common import quote
+from crptoolkit.flush import smooth
+
+INTEGER_TYPES = ("tinyint", "smallint", "mediumint", "int", "bigint")
+TEXT_LIMITS = {"tinytext": 255, "text": 65535, "mediumtext": 16777215, "longtext": 4294967295}
+# Character sets that can store characters outside the BMP (4 bytes in UTF-8)
+SUPPLEMENTARY = ("utf8mb4", "utf16", "utf16le", "utf32", "gb18030")
+
+def window_functions(version):
+    """
+    MySQL 8.0 and MariaDB 10.2 added window functions
+    Returns boolean
+    """
+    numbers = tuple(int(number) for number in version.split("-", 1)[0].split(".")[:2])
+    return numbers >= ((10, 2) if "MariaDB" in version else (8, 0))
+
+class DataScanner:
+    """
+    Walks the string columns of tables in primary key ranged chunks and measures, server-side,
+    what CONVERT TO CHARACTER SET {charset} would do to the data: rows that do not survive the
+    round-trip, the largest converted value, byte growth, values with 4-byte UTF-8 characters
+    (sources that can store them) and values already holding UTF-8 bytes (single-byte sources).
+    Chunks are sized to take about {chunk_time} seconds, every chunk is a single read and waits
+    for the throttle.
+    Tables whose primary key starts with an integer are walked by key value ranges. With
+    {sample} < 100 only that percentage of the key values is read, the ranges in between are
+    jumped over, and tables estimated over {split_rows} rows are split into key ranges scanned
+    on all the connections of the pool. Other tables follow their primary key from chunk to
+    chunk and are read in full. {budget} bounds the seconds spent on one table (or range).
+    """
+
+    def __init__(self, mysql, log, charset, pool = None, throttle = None, chunk_time = 0.5, sample = 100, budget = None, min_chunk = 100, max_chunk = 100000, split_rows = 1000000):
+        self.mysql = mysql
+        self.log = log
+        self.charset = charset
+        self.pool = pool
+        self.throttle = throttle
+        self.chunk_time = chunk_time
+        self.sample = sample
+        self.budget = budget
+        self.min_chunk = min_chunk
+        self.max_chunk = max_chunk
+        self.split_rows = split_rows
+
+    def describe(self, mysql, schema, table):
+        """
+        Primary key and string columns (not already in {charset}) of one table
+        Returns (list of (primary key column, data_type), list of (column, data_type, charset, maxlen), estimated rows)
+        """
+        escape = mysql.connection.escape
+        where = f"table_schema = {escape(schema)} AND table_name = {escape(table)}"
+        primary = [tuple(row) for row in mysql.stream_query(f"SELECT s.column_name, c.data_type FROM information_schema.statistics s JOIN information_schema.columns c ON c.table_schema = s.table_schema AND c.table_name = s.table_name AND c.column_name = s.column_name WHERE s.table_schema = {escape(schema)} AND s.table_name = {escape(table)} AND s.index_name = 'PRIMARY' ORDER BY s.seq_in_index", pymysql.cursors.SSCursor)]
+        columns = [tuple(row) for row in mysql.stream_query(f"SELECT c.column_name, c.data_type, c.character_set_name, s.maxlen FROM information_schema.columns c JOIN information_schema.character_sets s ON s.character_set_name = c.character_set_name WHERE c.table_schema = {escape(schema)} AND c.table_name = {escape(table)} AND c.character_set_name <> {escape(self.charset)} ORDER BY c.ordinal_position", pymysql.cursors.SSCursor)]
+        estimate = [row[0] for row in mysql.stream_query(f"SELECT table_rows FROM information_schema.tables WHERE {where}", pymysql.cursors.SSCursor)]
+        return primary, columns, int(estimate[0] or 0) if estimate else 0
+
+    def measures(self, columns):
+        """
+        One aggregate per measure and column, so a chunk costs a single round-trip
+        Returns SELECT list
+        """
+        parts = ["COUNT(*) AS `rows`"]
+        for number, (name, data_type, charset, maxlen) in enumerate(columns):
+            column = quote(name)
+            converted = f"CONVERT({column} USING {self.charset})"
+            parts.append(f"SUM(CAST(CONVERT({converted} USING {charset}) AS BINARY) <> CAST({column} AS BINARY)) AS lossy_{number}")
+            parts.append(f"MAX(LENGTH({converted})) AS max_{number}")
+            parts.append(f"SUM(LENGTH({column})) AS before_{number}")
+            parts.append(f"SUM(LENGTH({converted})) AS after_{number}")
+            if data_type in TEXT_LIMITS:
+                parts.append(f"SUM(LENGTH({converted}) > {TEXT_LIMITS[data_type]}) AS over_{number}")
+            if charset in SUPPLEMENTARY:
+                # Only characters outside the BMP do not survive utf8mb3
+                parts.append(f"SUM(CAST(CONVERT({column} USING utf8mb3) AS BINARY) <> CAST(CONVERT({column} USING utf8mb4) AS BINARY)) AS four_{number}")
+            elif int(maxlen) == 1:
+                # Bytes that decode as multi-byte UTF-8 are fewer characters than bytes (invalid bytes
+                # decode one for one), such values were written as UTF-8 and would be double-encoded
+                parts.append(f"SUM(CHAR_LENGTH(CONVERT(CAST({column} AS BINARY) USING utf8mb4)) < LENGTH({column})) AS double_{number}")
+        return ", ".join(parts)
+
+    def bound(self, mysql, primary, values, operator):
+        return f"({', '.join(map(quote, primary))}) {operator} ({', '.join(map(mysql.connection.escape, values))})"
+
+    def resize(self, chunk, rows, elapsed):
+        """
+        Moves the chunk size towards {chunk_time}, at most doubling per chunk so one
+        chunk served from the buffer pool does not overshoot
+        Returns int
+        """
+        if rows == 0 or elapsed <= 0:
+            return min(chunk * 2, self.max_chunk)
+        wanted = smooth(chunk, rows / elapsed * self.chunk_time, 0.5)
+        return int(max(self.min_chunk, min(self.max_chunk, chunk * 2, wanted)))
+
+    def plan(self, mysql, schema, table):
+        """
+        Describes one table and, for integer primary keys, reads the key's bounds (both ends of the index)
+        Returns dictionary
+        """
+        mysql.label = "scan"
+        plan = {"schema": schema, "table": table, "name": f"{quote(schema)}.{quote(table)}", "started": monotonic(), "note": ""}
+        primary, columns, estimate = self.describe(mysql, schema, table)
+        plan.update(primary=[column for column, _ in primary], columns=columns, estimate=estimate, low=None, high=None)
+        if not primary:
+            plan["note"] = "no primary key, not scanned"
+            return plan
+        if not columns:
+            plan["note"] = "no string columns to convert"
+            return plan
+        plan["measures"] = self.measures(columns)
+        plan["integer"] = primary[0][1] in INTEGER_TYPES
+        plan["windows"] = not plan["integer"] and window_functions(mysql.get_variable("version"))
+        if plan["integer"]:
+            key = quote(plan["primary"][0])
+            row = mysql.run_query(f"SELECT MIN({key}) AS low, MAX({key}) AS high FROM {plan['name']}")[0]
+            plan["low"], plan["high"] = row["low"], row["high"]
+        return plan
+
+    def jobs(self, plan, parts = 1):
+        """
+        Splits the scan of a table into up to {parts} key ranges (integer primary keys only)
+        Returns list of function(mysql)
+        """
+        if plan["note"]:
+            return []
+        if not plan["integer"]:
+            return [lambda mysql: self.scan_keyset(mysql, plan)]
+        if plan["low"] is None:
+            return []
+        keys = plan["high"] - plan["low"] + 1
+        parts = max(1, min(parts, plan["estimate"] // self.split_rows, keys))
+        bounds = [plan["low"] + keys * part // parts for part in range(parts + 1)]
+        return [(lambda mysql, lower = lower, upper = upper: self.scan_range(mysql, plan, lower, upper)) for lower, upper in zip(bounds, bounds[1:])]
+
+    def totals(self):
+        return {"rows": 0, "lossy": 0, "over": 0, "four": 0, "double": 0, "before": 0, "after": 0, "max": 0, "keys": 0, "lossy_columns": set(), "note": "", "finished": None}
+
+    def add(self, totals, columns, row):
+        totals["rows"] += row["rows"]
+        for number, (column, _, _, _) in enumerate(columns):
+            if (lossy := int(row[f"lossy_{number}"] or 0)):
+                totals["lossy"] += lossy
+                totals["lossy_columns"].add(column)
+            totals["max"] = max(totals["max"], int(row[f"max_{number}"] or 0))
+            for measure in ("over", "four", "double", "before", "after"):
+                totals[measure] += int(row.get(f"{measure}_{number}") or 0)
+
+    def scan_range(self, mysql, plan, lower, upper):
+        """
+        Measures the integer key range [lower, upper) of a table. Chunks are key ranges sized
+        from the rows per key value seen so far, so one range read measures a chunk and with
+        {sample} < 100 the keys between chunks are jumped over without being read. A range is at
+        most twice as wide as the one before and the first range, or a wider one, ends at the
+        key where a LIMITed probe counts {chunk} rows (the table's row estimate may be 0 or stale).
+        Returns dictionary of totals
+        """
+        mysql.label = "scan"
+        key = quote(plan["primary"][0])
+        totals = self.totals()
+        density = width = span = None
+        chunk = self.min_chunk * 10
+        start = monotonic()
+        while lower < upper:
+            if self.throttle is not None:
+                self.throttle.wait()
+            began = monotonic()
+            end = upper if width is None else min(upper, lower + width)
+            if width is None or width > span:
+                # A wider range first finds where {chunk} rows end, the key may be denser than seen so far
+                probe = mysql.run_query(f"SELECT {key} AS crp_end FROM {plan['name']} FORCE INDEX (PRIMARY) WHERE {key} >= {int(lower)} AND {key} < {int(end)} ORDER BY {key} LIMIT {int(chunk) - 1}, 1")
+                if type(probe) == list:
+                    end = int(probe[0]["crp_end"]) + 1
+            row = mysql.run_query(f"SELECT {plan['measures']} FROM {plan['name']} FORCE INDEX (PRIMARY) WHERE {key} >= {int(lower)} AND {key} < {int(end)}")[0]
+            elapsed = monotonic() - began
+            self.add(totals, plan["columns"], row)
+            totals["keys"] += end - lower
+            self.log.verbose(f"Scanned {row['rows']} rows of {plan['name']} in {elapsed:.2f} seconds.")
+            if self.budget is not None and monotonic() - start > self.budget and end < upper:
+                totals["note"] = f"stopped after the {self.budget}s budget"
+                break
+            # Gaps in the key (no rows) widen the next range
+            span = end - lower
+            observed = row["rows"] / span
+            density = observed if density is None else smooth(density, observed, 0.5) if observed else density / 2
+            chunk = self.resize(chunk, row["rows"], elapsed)
+            width = max(1, min(span * 2, int(chunk / density))) if density else span * 2
+            if self.sample < 100:
+                end += int((end - lower) * (100 - self.sample) / self.sample)
+            lower = end
+        totals["finished"] = monotonic()
+        return totals
+
+    def scan_keyset(self, mysql, plan):
+        """
+        Measures a table whose primary key does not start with an integer, following the key
+        from chunk to chunk. The last key of a chunk comes back with its measures (ranked by a
+        window over the chunk), so a chunk is read once. Without window functions (MySQL 5.7)
+        the last key is looked up first and the chunk is read up to it.
+        Returns dictionary of totals
+        """
+        mysql.label = "scan"
+        primary = plan["primary"]
+        key = ", ".join(map(quote, primary))
+        selected = ", ".join(map(quote, dict.fromkeys(primary + [column for column, _, _, _ in plan["columns"]])))
+        descending = ", ".join(f"{quote(column)} DESC" for column in primary)
+        last = ", ".join(f"MAX(IF(crp_last = 1, {quote(column)}, NULL)) AS last_{number}" for number, column in enumerate(primary))
+        totals = self.totals()
+        chunk = self.min_chunk * 10
+        lower = None
+        start = monotonic()
+        while True:
+            if self.throttle is not None:
+                self.throttle.wait()
+            began = monotonic()
+            where = f" WHERE {self.bound(mysql, primary, lower, '>')}" if lower is not None else ""
+            if plan["windows"]:
+                page = f"SELECT {selected} FROM {plan['name']} FORCE INDEX (PRIMARY){where} ORDER BY {key} LIMIT {int(chunk)}"
+                row = mysql.run_query(f"SELECT {plan['measures']}, {last} FROM (SELECT {selected}, ROW_NUMBER() OVER (ORDER BY {descending}) AS crp_last FROM ({page}) page) chunk")[0]
+                upper = tuple(row[f"last_{number}"] for number in range(len(primary))) if row["rows"] >= chunk else None
+            else:
+                boundary = mysql.run_query(f"SELECT {key} FROM {plan['name']} FORCE INDEX (PRIMARY){where} ORDER BY {key} LIMIT {int(chunk) - 1}, 1")
+                upper = tuple(boundary[0][column] for column in primary) if type(boundary) == list else None
+                if upper is not None:
+                    where += f" {'AND' if where else 'WHERE'} {self.bound(mysql, primary, upper, '<=')}"
+                row = mysql.run_query(f"SELECT {plan['measures']} FROM {plan['name']} FORCE INDEX (PRIMARY){where}")[0]
+            elapsed = monotonic() - began
+            self.add(totals, plan["columns"], row)
+            self.log.verbose(f"Scanned {row['rows']} rows of {plan['name']} in {elapsed:.2f} seconds.")
+            if upper is None:
+                break
+            if self.budget is not None and monotonic() - start > self.budget:
+                totals["note"] = f"stopped after the {self.budget}s budget"
+                break
+            chunk = self.resize(chunk, row["rows"], elapsed)
+            lower = upper
+        totals["finished"] = monotonic()
+        return totals
+
+    def result(self, plan, parts, error = None):
+        """
+        Merges the totals of a table's ranges. Sampled or partial scans are projected to the whole
+        key range (integer keys) or the estimated row count.
+        Returns dictionary
+        """
+        result = {"table_schema": plan["schema"], "table_name": plan["table"], "rows_scanned": 0, "lossy_values": 0, "lossy_columns": "", "max_bytes": 0, "over_limit_values": 0, "four_byte_values": 0, "double_encoded_values": 0, "growth_pct": 0.0, "projected_growth_mb": 0.0, "seconds": 0.0, "note": plan["note"]}
+        finished = max([part["finished"] for part in parts] + [monotonic() if error is not None or not parts else 0])
+        result["seconds"] = round(finished - plan["started"], 1)
+        if error is not None:
+            result["note"] = f"failed: {error}"
+            return result
+        if plan["note"] or not parts:
+            return result
+        totals = self.totals()
+        for part in parts:
+            for measure, value in part.items():
+                if measure == "lossy_columns":
+                    totals[measure] |= value
+                elif measure == "max":
+                    totals[measure] = max(totals[measure], value)
+                elif measure not in ("note", "finished"):
+                    totals[measure] += value
+        notes = sorted({part["note"] for part in parts if part["note"]})
+        if plan["integer"]:
+            keys = plan["high"] - plan["low"] + 1
+            scale = keys / totals["keys"] if totals["keys"] else 1
+            if self.sample < 100:
+                notes.insert(0, f"{self.sample:g}% sample")
+        else:
+            scale = max(plan["estimate"], totals["rows"]) / totals["rows"] if totals["rows"] and notes else 1
+            if self.sample < 100:
+                notes.insert(0, "read in full, the primary key does not start with an integer")
+        growth = totals["after"] - totals["before"]
+        result.update({
+            "rows_scanned": totals["rows"],
+            "lossy_values": totals["lossy"],
+            "lossy_columns": ", ".join(sorted(totals["lossy_columns"])),
+            "max_bytes": totals["max"],
+            "over_limit_values": totals["over"],
+            "four_byte_values": totals["four"],
+            "double_encoded_values": totals["double"],
+            "growth_pct": round(growth * 100 / totals["before"], 1) if totals["before"] else 0.0,
+            "projected_growth_mb": round(growth * scale / 1048576, 1),
+            "note": ", ".join(notes)
+            })
+        return result
+
+    def scan_table(self, mysql, schema, table):
+        """
+        Measures one table on one connection
+        Returns dictionary
+        """
+        plan = {"schema": schema, "table": table, "started": monotonic(), "note": ""}
+        try:
+            plan = self.plan(mysql, schema, table)
+            return self.result(plan, [job(mysql) for job in self.jobs(plan)])
+        except MySQLError as e:
+            return self.result(plan, [], e)
+
+    def run(self, tables):
+        """
+        Scans (schema, table) pairs, concurrently over the connection pool when there is one.
+        Tables are described as they are scheduled and large ones are split in key ranges.
+        Yields one dictionary per table, in the given order
+        """
+        if self.pool is None:
+            for schema, table in tables:
+                yield self.scan_table(self.mysql, schema, table)
+            return
+        plans = {(schema, table): self.pool.submit(lambda mysql, schema = schema, table = table: self.plan(mysql, schema, table)) for schema, table in tables}
+        scans = {}
+        for (schema, table), future in plans.items():
+            try:
+                plan = future.result()
+                scans[schema, table] = (plan, [self.pool.submit(job) for job in self.jobs(plan, self.pool.size)], None)
+            except MySQLError as e:
+                scans[schema, table] = ({"schema": schema, "table": table, "started": monotonic(), "note": ""}, [], e)
+        for plan, futures, error in scans.values():
+            parts = []
+            for future in futures:
+                try:
+                    parts.append(future.result())
+                except MySQLError as e:
+                    error = e
+            yield self.result(plan, parts, error)
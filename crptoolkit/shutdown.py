@@ -0,0 +1,139 @@
+from time import monotonic
+from crptoolkit.args import ArgParser
+from crptoolkit.flush import FlushMonitor
+from crptoolkit.logger import Logger
+from crptoolkit.mysql import MySQL
+from crptoolkit.output import Output
+from crptoolkit.readiness import ShutdownReadiness
+from crptoolkit.trace import QueryTracer
+from crptoolkit.transactions import TransactionWatcher
+from crptoolkit.warmup import capture
+
+class MySQLPrepareShutdown:
+
+    def __init__(self, args, mysql = None, log = None):
+        self.args = ArgParser(args)
+        self.no_transaction_check = args.no_transaction_check
+        self.transaction_threshold = args.transaction_threshold
+        self.watch_transactions = args.watch_transactions
+        self.watch_interval = args.watch_interval
+        self.replication_timeout = args.replication_timeout
+        self.flush_target = args.flush_target
+        self.flush_timeout = args.flush_timeout
+        self.shutdown_budget = args.shutdown_budget
+        self.readiness_timeout = args.readiness_timeout
+        self.warmup_capture = args.warmup_capture
+        self.verbose = args.verbose
+        self.profile = args.profile
+        self.trace = args.trace
+        self.format = args.format
+        self.tracer = QueryTracer(self.trace) if self.profile or self.trace else None
+        if mysql is None:
+            mysql = MySQL(*self.args.connect())
+        if self.tracer is not None:
+            mysql.add_hook(self.tracer)
+        if mysql.connection is None:
+            mysql.connect()
+        self.defaults_file, self.host, self.port, self.user, self.password, self.socket = mysql.defaults_file, mysql.host, mysql.port, mysql.user, mysql.password, mysql.socket
+        self.mysql = mysql
+        self.log = log if log is not None else Logger(self.verbose, Output(self.format))
+        self.mysql.output = self.log.output
+
+    def run(self):
+        self.log.info("[ START ] Preparing MySQL for shutdown.")
+
+        self.mysql.label = "variables"
+        # Fetch every variable this tool reads in a single round-trip
+        self.mysql.get_variables(["gtid_mode", "slave_parallel_workers", "innodb_max_dirty_pages_pct", "innodb_buffer_pool_load_at_startup"])
+
+        # If it's a replica, stop replication
+        self.mysql.label = "replication"
+        self.log.info("Checking if this is a replica.")
+        if (is_replica := self.mysql.is_replica()):
+            self.log.info("This is a replica. Stopping replication.")
+            if not self.mysql.stop_replication(self.log, self.replication_timeout):
+                self.log.info("Restarting replication because of a problem.")
+                self.mysql.start_replication()
+                self.log.error(f"The SQL thread did not catch up within {self.replication_timeout} seconds. Retry once replication lag is lower or raise --replication-timeout.")
+            self.log.verbose("Replication stopped.")
+
+        # Check for long running transactions
+        self.mysql.label = "transactions"
+        if self.no_transaction_check:
+            self.log.warn("--no-transaction-check was used. Not checking for long running transactions.")
+        else:
+            self.log.info(f"Checking for transactions running > {self.transaction_threshold}s.")
+            if not self.wait_for_transactions():
+                if is_replica:
+                    self.log.info("Restarting replication because of a problem.")
+                    self.mysql.start_replication()
+                self.log.error(f"Transaction(s) found running > {self.transaction_threshold} seconds. COMMIT, ROLLBACK, or kill them. Otherwise, use the less safe `--no-transaction-check`.")
+            self.log.info(f"There are no transactions running > {self.transaction_threshold} seconds.")
+
+        # Set dirty pages to 0 then check they are low enough
+        self.mysql.label = "flush"
+        dirty_pages_pct_original = float(self.mysql.get_variable("innodb_max_dirty_pages_pct"))
+        self.log.info("Setting innodb_max_dirty_pages_pct -> 0.0.")
+        self.mysql.set_variable("innodb_max_dirty_pages_pct", 0.0)
+        flush_monitor = FlushMonitor(self.mysql, self.log, target=self.flush_target, timeout=self.flush_timeout)
+        try:
+            flush_monitor.wait()
+            if self.shutdown_budget is not None:
+                self.mysql.label = "readiness"
+                self.log.info("Checking shutdown readiness.")
+                ShutdownReadiness(self.mysql, self.log, budget=self.shutdown_budget, timeout=self.readiness_timeout).wait()
+        except KeyboardInterrupt:
+            self.mysql.set_variable("innodb_max_dirty_pages_pct", dirty_pages_pct_original)
+            if is_replica:
+                self.log.info("Restarting replication because of a problem.")
+                self.mysql.start_replication()
+                self.log.error("Received CTL+C. Reverted innodb_max_dirty_pages_pct and restarted replication before exiting.")
+            self.log.error("Received CTL+C. Reverted innodb_max_dirty_pages_pct before exiting.")
+
+        # Set fast shutdown to 0
+        self.mysql.label = "settings"
+        self.log.info("Setting innodb_fast_shutdown -> 0.")
+        self.mysql.set_variable("innodb_fast_shutdown", 0)
+
+        # Set buffer pool dump configurations
+        self.log.info("Setting innodb_buffer_pool_dump_at_shutdown -> ON.")
+        self.mysql.set_variable("innodb_buffer_pool_dump_at_shutdown", "ON")
+        self.log.info("Setting innodb_buffer_pool_dump_pct -> 75.")
+        self.mysql.set_variable("innodb_buffer_pool_dump_pct", 75)
+        if self.mysql.get_variable("innodb_buffer_pool_load_at_startup") == "OFF":
+            self.log.warn("innodb_buffer_pool_load_at_startup = OFF. You may want to enable this in the my.cnf: innodb_buffer_pool_load_at_startup = ON, or run crp-warmup --load-now after the restart.")
+
+        # Save what crp-warmup needs, performance_schema is emptied by the restart
+        if self.warmup_capture:
+            self.mysql.label = "capture"
+            self.log.info(f"Saving the warm-up capture to {self.warmup_capture}.")
+            indexes = capture(self.mysql, self.warmup_capture)
+            self.log.verbose(f"Captured the {indexes} most read indexes and the buffer pool hit ratio.")
+
+        if self.tracer is not None:
+            self.tracer.report(self.log, self.profile)
+        self.log.info("[ COMPLETED ] MySQL is prepared for shutdown!")
+
+    def wait_for_transactions(self):
+        """
+        Single check, or with --watch-transactions sample performance_schema until no transaction
+        is over the threshold, printing only what changed between samples
+        Returns True once no long running transactions remain
+        """
+        if not self.watch_transactions:
+            return not self.mysql.get_transactions(self.transaction_threshold)
+        watcher = TransactionWatcher(self.mysql, self.transaction_threshold)
+        if (missing := watcher.missing()):
+            self.log.warn(f"performance_schema does not collect every transaction, --watch-transactions is ignored. It needs {'; '.join(missing)}.")
+            return not self.mysql.get_transactions(self.transaction_threshold)
+        self.log.info(f"Watching transactions for up to {self.watch_transactions} seconds.")
+        deadline = monotonic() + self.watch_transactions
+        for active, events in watcher.watch(self.watch_interval):
+            if events:
+                self.log.rows(events)
+                self.log.output.flush()
+            if not active:
+                return True
+            if monotonic() >= deadline:
+                return False
+            self.log.verbose(f"{len(active)} transaction(s) still running > {self.transaction_threshold} seconds.")
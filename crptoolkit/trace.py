@@ -0,0 +1,62 @@
+import json
+from threading import Lock
+
+class QueryTracer:
+    """
+    MySQL hook that totals per-statement timings by label and optionally
+    streams every record to a JSON lines trace file.
+    """
+
+    FIELDS = ["statements", "connect", "execute", "fetch", "rows", "bytes"]
+
+    def __init__(self, path = None):
+        self.path = path
+        self.lock = Lock()
+        self.totals = {}
+        self.trace = open(path, "w") if path is not None else None
+
+    def __call__(self, record):
+        with self.lock:
+            totals = self.totals.setdefault(record["label"] or "-", dict.fromkeys(self.FIELDS, 0))
+            totals["statements"] += 1
+            for field in self.FIELDS[1:]:
+                totals[field] += record[field]
+            if self.trace is not None:
+                self.trace.write(json.dumps(record) + "\n")
+
+    def summary(self):
+        """
+        Totals per label, slowest first
+        Returns pretty formatted table
+        """
+        from prettytable import PrettyTable
+        table = PrettyTable(["label", "statements", "connect_s", "execute_s", "fetch_s", "total_s", "rows", "bytes"])
+        table.align = "l"
+        grand = dict.fromkeys(self.FIELDS, 0)
+        for label, totals in sorted(self.totals.items(), key=lambda item: -(item[1]["connect"] + item[1]["execute"] + item[1]["fetch"])):
+            for field in self.FIELDS:
+                grand[field] += totals[field]
+            table.add_row(self.row(label, totals))
+        table.add_row(self.row("TOTAL", grand))
+        return table
+
+    def row(self, label, totals):
+        total = totals["connect"] + totals["execute"] + totals["fetch"]
+        return [label, totals["statements"], f"{totals['connect']:.3f}", f"{totals['execute']:.3f}", f"{totals['fetch']:.3f}", f"{total:.3f}", totals["rows"], totals["bytes"]]
+
+    def report(self, log, profile):
+        """
+        Logs the summary (with {profile}) and where the trace went, then closes the trace
+        """
+        if profile:
+            log.newline()
+            log.no_timestamp("Query profile:")
+            log.no_timestamp(self.summary())
+        if self.path is not None:
+            log.info(f"Query trace written to {self.path}.")
+        self.close()
+
+    def close(self):
+        if self.trace is not None:
+            self.trace.close()
+            self.trace = None
@@ -0,0 +1,97 @@
+from time import monotonic, sleep
+
+class TransactionWatcher:
+    """
+    Samples active transactions from performance_schema, which unlike innodb_trx joined with
+    the legacy processlist takes no global mutexes, and diffs consecutive samples so only
+    new, finished and growing transactions are reported. A transaction is growing once its
+    duration has doubled since it was last reported.
+    """
+
+    SQL = ("SELECT t.thread_id, t.processlist_id, t.processlist_user AS user, t.processlist_host AS host, t.processlist_db AS db, "
+           "tx.event_id, tx.timer_wait / 1e12 AS seconds, tx.access_mode, tx.isolation_level, LEFT(s.sql_text, 64) AS statement "
+           "FROM performance_schema.events_transactions_current AS tx "
+           "JOIN performance_schema.threads AS t ON t.thread_id = tx.thread_id "
+           "LEFT JOIN performance_schema.events_statements_current AS s ON s.thread_id = tx.thread_id AND s.nesting_event_level = 0 "
+           "WHERE tx.state = 'ACTIVE' AND t.type = 'FOREGROUND' AND tx.timer_wait > {picoseconds} "
+           "ORDER BY tx.timer_wait DESC")
+
+    def __init__(self, mysql, min_seconds = 0):
+        self.mysql = mysql
+        self.min_seconds = min_seconds
+        self.reported = {}
+
+    def missing(self):
+        """
+        Checks that every transaction is instrumented, timed and collected: the consumer and
+        its parents, the transaction instrument (TIMED, or timer_wait is NULL), setup_actors
+        and the instrumented flag of the connected threads
+        Returns list of what is missing (empty if nothing is)
+        """
+        sql = ("SELECT (SELECT COUNT(*) FROM performance_schema.setup_consumers WHERE name IN ('global_instrumentation', 'thread_instrumentation', 'events_transactions_current') AND enabled = 'YES') = 3 AS consumers, "
+               "(SELECT enabled = 'YES' AND timed = 'YES' FROM performance_schema.setup_instruments WHERE name = 'transaction') AS instrument, "
+               "NOT EXISTS (SELECT 1 FROM performance_schema.setup_actors WHERE enabled = 'NO') AND EXISTS (SELECT 1 FROM performance_schema.setup_actors WHERE host = '%' AND user = '%' AND enabled = 'YES') AS actors, "
+               "NOT EXISTS (SELECT 1 FROM performance_schema.threads WHERE type = 'FOREGROUND' AND instrumented = 'NO') AS threads")
+        result = self.mysql.run_query(sql)
+        if type(result) != list:
+            return ["performance_schema"]
+        requirements = {
+                "consumers": "the global_instrumentation, thread_instrumentation and events_transactions_current consumers",
+                "instrument": "the transaction instrument, enabled and timed",
+                "actors": "setup_actors instrumenting every user",
+                "threads": "every foreground thread instrumented"
+                }
+        return [requirement for name, requirement in requirements.items() if not result[0][name]]
+
+    def available(self):
+        """
+        Checks that transaction events are collected for every transaction
+        Returns bool
+        """
+        return not self.missing()
+
+    def sample(self):
+        """
+        Active transactions running longer than {min_seconds}
+        Returns dictionary of (thread_id, event_id) to row
+        """
+        sample = {}
+        for row in self.mysql.stream_query(self.SQL.format(picoseconds=int(self.min_seconds * 1e12))):
+            row["seconds"] = round(float(row["seconds"] or 0), 1)
+            sample[(row["thread_id"], row.pop("event_id"))] = row
+        return sample
+
+    def diff(self, previous, current):
+        """
+        Compares two samples
+        Returns list of dictionaries with an event of new, growing or finished
+        """
+        events = []
+        for key, row in current.items():
+            if key not in previous:
+                self.reported[key] = row["seconds"]
+                events.append({"event": "new", **row})
+            elif row["seconds"] >= 2 * max(self.reported[key], 1):
+                self.reported[key] = row["seconds"]
+                events.append({"event": "growing", **row})
+        for key, row in previous.items():
+            if key not in current:
+                self.reported.pop(key, None)
+                events.append({"event": "finished", **row})
+        return events
+
+    def watch(self, interval = 1, duration = None):
+        """
+        Samples every {interval} seconds, for {duration} seconds or forever
+        Yields (current sample, events) per sample
+        """
+        previous = {}
+        deadline = None if duration is None else monotonic() + duration
+        while True:
+            started = monotonic()
+            current = self.sample()
+            yield current, self.diff(previous, current)
+            previous = current
+            if deadline is not None and monotonic() >= deadline:
+                return
+            sleep(max(0, interval - (monotonic() - started)))
@@ -0,0 +1,261 @@
+import re
+import pymysql.cursors
+from pymysql.err import MySQLError
+from time import monotonic, sleep
+from crptoolkit.args import ArgParser
+from crptoolkit.common import SYSTEM_SCHEMAS_SQL, quote, read_snapshot, save_snapshot
+from crptoolkit.flush import duration, smooth
+from crptoolkit.logger import Logger
+from crptoolkit.mysql import ConnectionPool, MySQL
+from crptoolkit.output import Output
+from crptoolkit.trace import QueryTracer
+
+VERSION = 1
+BASELINE_COUNTERS = ["Innodb_buffer_pool_read_requests", "Innodb_buffer_pool_reads", "Uptime"]
+
+def capture(mysql, path, limit = 500):
+    """
+    Writes what a warm-up needs from this server before it restarts: the most read indexes
+    from performance_schema (which a restart empties) and the hit ratio and disk read rate
+    averaged since startup. The file is replaced atomically.
+    Returns number of indexes captured
+    """
+    sql = ("SELECT object_schema, object_name, IFNULL(index_name, 'PRIMARY'), SUM(count_read) AS count_read "
+           "FROM performance_schema.table_io_waits_summary_by_index_usage "
+           f"WHERE object_type = 'TABLE' AND object_schema NOT IN {SYSTEM_SCHEMAS_SQL} AND count_read > 0 "
+           f"GROUP BY 1, 2, 3 ORDER BY count_read DESC LIMIT {int(limit)}")
+    indexes = [list(row) for row in mysql.stream_query(sql, pymysql.cursors.SSCursor)]
+    counters = mysql.status_snapshot(BASELINE_COUNTERS)[1]
+    requests, reads, uptime = (counters.get(name, 0) for name in BASELINE_COUNTERS)
+    snapshot = {
+            "server": mysql.get_variable("server_uuid"),
+            "baseline": {
+                "hit_ratio": 1 - reads / requests if requests else None,
+                "reads_per_second": reads / uptime if uptime else None
+                },
+            "indexes": indexes
+            }
+    save_snapshot(path, VERSION, snapshot)
+    return len(indexes)
+
+def read_capture(path):
+    """
+    Loads a file written by capture()
+    Returns dictionary or None if it is from another format version
+    """
+    return read_snapshot(path, VERSION)
+
+class BufferPoolWarmup:
+    """
+    Brings a restarted server's buffer pool back: follows (or starts) the load of the pages
+    dumped at shutdown, pre-reads the indexes that were hottest before the restart into the
+    pages still free, and watches the hit ratio and disk read rate until they are back to the
+    baseline captured before the restart.
+    """
+
+    def __init__(self, mysql, log, pool = None, interval = 5, alpha = 0.3):
+        self.mysql = mysql
+        self.log = log
+        self.pool = pool
+        self.interval = interval
+        self.alpha = alpha
+
+    def load(self, trigger = False, timeout = 3600):
+        """
+        Streams Innodb_buffer_pool_load_status, after setting innodb_buffer_pool_load_now when {trigger}
+        Returns boolean (True once the load completed)
+        """
+        previous = None
+        if trigger:
+            # A finished earlier load keeps its status until the new one reports progress
+            previous = self.mysql.get_status_variable("Innodb_buffer_pool_load_status")
+            self.log.info("Setting innodb_buffer_pool_load_now -> ON.")
+            self.mysql.set_variable("innodb_buffer_pool_load_now", "ON")
+        stale = previous
+        deadline = monotonic() + timeout
+        rate = None
+        last = None
+        while True:
+            status = self.mysql.get_status_variable("Innodb_buffer_pool_load_status") or ""
+            if status == stale:
+                pass
+            elif "completed" in status:
+                self.log.info(status)
+                return True
+            elif "aborted" in status or "Cannot" in status:
+                self.log.warn(f"{status}. Continuing without the buffer pool load.")
+                return False
+            elif "not started" in status and not trigger:
+                self.log.warn("No buffer pool load is running. Use --load-now to start one from the dump file.")
+                return False
+            elif (match := re.search(r"Loaded (\d+)/(\d+) pages", status)):
+                loaded, total = int(match.group(1)), int(match.group(2))
+                now = monotonic()
+                if last is not None and now > last[0]:
+                    rate = smooth(rate, (loaded - last[1]) / (now - last[0]), self.alpha)
+                last = now, loaded
+                eta = (total - loaded) / rate if rate else None
+                self.log.info(f"{status}, {rate or 0:.0f} pages/s, ETA {duration(eta)}.")
+            elif status != previous:
+                self.log.info(status)
+            previous = status
+            if monotonic() >= deadline:
+                self.log.warn(f"It's been {duration(timeout)}. {status}. Continuing while the load goes on in the background.")
+                return False
+            sleep(min(self.interval, max(0, deadline - monotonic())))
+
+    def index_pages(self, indexes):
+        """
+        Sizes of the captured indexes from mysql.innodb_index_stats, in one round-trip
+        Returns dictionary of (schema, table, index) to pages
+        """
+        if not indexes:
+            return {}
+        escape = self.mysql.connection.escape
+        tables = ", ".join(f"({escape(schema)}, {escape(table)})" for schema, table in {(schema, table) for schema, table, *_ in indexes})
+        sql = ("SELECT database_name, table_name, index_name, stat_value FROM mysql.innodb_index_stats "
+               f"WHERE stat_name = 'size' AND (database_name, table_name) IN ({tables})")
+        return {(schema, table, index): int(pages) for schema, table, index, pages in self.mysql.stream_query(sql, pymysql.cursors.SSCursor)}
+
+    def read_index(self, mysql, schema, table, index):
+        """
+        Reads every page of one index
+        Returns dictionary
+        """
+        mysql.label = "preread"
+        start = monotonic()
+        result = {"table_schema": schema, "table_name": table, "index_name": index, "rows": None, "seconds": 0.0, "note": ""}
+        try:
+            result["rows"] = mysql.run_query(f"SELECT COUNT(*) AS `rows` FROM {quote(schema)}.{quote(table)} FORCE INDEX ({quote(index)})")[0]["rows"]
+        except MySQLError as e:
+            result["note"] = f"failed: {e}"
+        result["seconds"] = round(monotonic() - start, 1)
+        return result
+
+    def preread(self, indexes, limit = 100):
+        """
+        Reads the {limit} most read indexes (as captured) that still fit in the free buffer pool
+        pages, so nothing the load brought back is evicted. Runs over the connection pool when there is one.
+        Yields one dictionary per index read
+        """
+        free = int(self.mysql.get_status_variable("Innodb_buffer_pool_pages_free") or 0)
+        sizes = self.index_pages(indexes[:limit])
+        wanted = []
+        for schema, table, index, *_ in indexes[:limit]:
+            pages = sizes.get((schema, table, index))
+            if pages is None:
+                self.log.verbose(f"Skipping {schema}.{table} ({index}), it has no size in mysql.innodb_index_stats.")
+            elif pages > free:
+                self.log.verbose(f"Skipping {schema}.{table} ({index}), its {pages} pages do not fit in the {free} free pages.")
+            else:
+                free -= pages
+                wanted.append((schema, table, index))
+        self.log.info(f"Pre-reading {len(wanted)} of the {min(limit, len(indexes))} most read indexes.")
+        if self.pool is None:
+            for schema, table, index in wanted:
+                yield self.read_index(self.mysql, schema, table, index)
+            return
+        jobs = {key: (lambda mysql, key = key: self.read_index(mysql, *key)) for key in wanted}
+        for _, result in self.pool.run(jobs):
+            yield result
+
+    def monitor(self, baseline, tolerance = 10, timeout = 1800):
+        """
+        Samples the hit ratio and disk read rate every {interval} seconds until both are within
+        {tolerance} percent of {baseline} (the miss ratio, not the hit ratio, is compared so
+        the tolerance means the same at 99% and 99.99%)
+        Returns list of dictionaries comparing the last sample with the baseline
+        """
+        counters = ["Innodb_buffer_pool_read_requests", "Innodb_buffer_pool_reads"]
+        factor = 1 + tolerance / 100
+        deadline = monotonic() + timeout
+        previous = self.mysql.status_snapshot(counters)
+        hit_ratio = reads = None
+        while True:
+            sleep(min(self.interval, max(0, deadline - monotonic())))
+            snapshot = self.mysql.status_snapshot(counters)
+            rates = self.mysql.status_rates(previous, snapshot)
+            previous = snapshot
+            reads = smooth(reads, rates["Innodb_buffer_pool_reads"], self.alpha)
+            if rates["Innodb_buffer_pool_read_requests"] > 0:
+                hit_ratio = smooth(hit_ratio, 1 - rates["Innodb_buffer_pool_reads"] / rates["Innodb_buffer_pool_read_requests"], self.alpha)
+            hit_back = hit_ratio is not None and (baseline["hit_ratio"] is None or 1 - hit_ratio <= (1 - baseline["hit_ratio"]) * factor)
+            reads_back = baseline["reads_per_second"] is None or reads <= baseline["reads_per_second"] * factor
+            elapsed = timeout - max(0, deadline - monotonic())
+            if hit_back and reads_back:
+                self.log.info(f"Hit ratio and disk reads are back to baseline after {duration(elapsed)}.")
+                break
+            if monotonic() >= deadline:
+                self.log.warn(f"It's been {duration(timeout)} and the buffer pool is not back to baseline yet.")
+                break
+            hit = "unknown (no reads)" if hit_ratio is None else f"{hit_ratio:.2%}"
+            self.log.info(f"Hit ratio {hit}, {reads:.0f} disk reads/s.")
+        return [
+                {"measure": "hit ratio", "baseline": None if baseline["hit_ratio"] is None else f"{baseline['hit_ratio']:.2%}", "current": None if hit_ratio is None else f"{hit_ratio:.2%}", "back": hit_back},
+                {"measure": "disk reads/s", "baseline": None if baseline["reads_per_second"] is None else round(baseline["reads_per_second"], 1), "current": round(reads, 1), "back": reads_back}
+                ]
+
+class MySQLWarmup:
+
+    def __init__(self, args):
+        self.args = ArgParser(args)
+        self.load_now = args.load_now
+        self.no_load = args.no_load
+        self.load_timeout = args.load_timeout
+        self.capture = args.capture
+        self.preread = args.preread
+        self.parallel = args.parallel
+        self.tolerance = args.tolerance
+        self.monitor_timeout = args.monitor_timeout
+        self.interval = args.interval
+        self.verbose = args.verbose
+        self.profile = args.profile
+        self.trace = args.trace
+        self.format = args.format
+        self.tracer = QueryTracer(self.trace) if self.profile or self.trace else None
+        self.defaults_file, self.host, self.port, self.user, self.password, self.socket = self.args.connect()
+        self.mysql = MySQL(self.defaults_file, self.host, self.port, self.user, self.password, self.socket)
+        if self.tracer is not None:
+            self.mysql.add_hook(self.tracer)
+        self.mysql.connect()
+        self.log = Logger(self.verbose, Output(self.format))
+        self.mysql.output = self.log.output
+        self.pool = ConnectionPool(self.mysql, self.parallel) if self.parallel > 1 else None
+        self.warmup = BufferPoolWarmup(self.mysql, self.log, self.pool, self.interval)
+
+    def run(self):
+        self.log.info("[ START ] Warming up the buffer pool.")
+
+        snapshot = None
+        if self.capture:
+            if (snapshot := read_capture(self.capture)) is None:
+                self.log.error(f"{self.capture} was written by another version of the toolkit. Capture it again before the next restart.")
+            self.mysql.label = "variables"
+            if snapshot["server"] != self.mysql.get_variable("server_uuid"):
+                self.log.warn(f"{self.capture} was captured on another server (server_uuid {snapshot['server']}).")
+
+        # Follow or start the buffer pool load
+        if not self.no_load:
+            self.mysql.label = "load"
+            self.log.info("Checking the buffer pool load.")
+            self.warmup.load(self.load_now, self.load_timeout)
+
+        # Pre-read the hottest indexes into the free pages
+        if snapshot is not None and self.preread:
+            self.mysql.label = "preread"
+            self.log.section("preread", "Pre-read indexes", self.warmup.preread(snapshot["indexes"], self.preread))
+
+        # Wait for the hit ratio and disk reads to return to the baseline
+        if snapshot is not None and self.monitor_timeout:
+            self.mysql.label = "monitor"
+            self.log.info(f"Waiting for the hit ratio and disk reads to get within {self.tolerance:g}% of the baseline.")
+            try:
+                self.log.section("monitor", "Compared with the baseline", self.warmup.monitor(snapshot["baseline"], self.tolerance, self.monitor_timeout))
+            except KeyboardInterrupt:
+                self.log.warn("Received CTL+C. Stopped waiting for the baseline.")
+
+        if self.pool is not None:
+            self.pool.close()
+        if self.tracer is not None:
+            self.tracer.report(self.log, self.profile)
+        self.log.info("[ COMPLETED ] Buffer pool warm-up is done.")
@@ -0,0 +1,36 @@
+from crptoolkit.args import ArgParser
+from crptoolkit.logger import Logger
+from crptoolkit.mysql import MySQL
+from crptoolkit.output import Output
+from crptoolkit.transactions import TransactionWatcher
+
+class MySQLWatchTransactions:
+
+    def __init__(self, args):
+        self.args = ArgParser(args)
+        self.threshold = args.threshold
+        self.interval = args.interval
+        self.duration = args.duration
+        self.verbose = args.verbose
+        self.format = args.format
+        self.defaults_file, self.host, self.port, self.user, self.password, self.socket = self.args.connect()
+        self.mysql = MySQL(self.defaults_file, self.host, self.port, self.user, self.password, self.socket)
+        self.mysql.connect()
+        self.log = Logger(self.verbose, Output(self.format))
+        self.mysql.output = self.log.output
+
+    def run(self):
+        self.log.info(f"[ START ] Watching transactions running > {self.threshold} seconds every {self.interval} seconds.")
+        self.mysql.label = "watch"
+        watcher = TransactionWatcher(self.mysql, self.threshold)
+        if (missing := watcher.missing()):
+            self.log.error(f"performance_schema does not collect every transaction. It needs {'; '.join(missing)}.")
+        try:
+            for active, events in watcher.watch(self.interval, self.duration):
+                if events:
+                    self.log.rows(events)
+                    self.log.output.flush()
+                self.log.verbose(f"{len(active)} transaction(s) running > {self.threshold} seconds.")
+        except KeyboardInterrupt:
+            pass
+        self.log.info("[ COMPLETED ]")
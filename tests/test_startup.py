@@ -0,0 +1,31 @@
+"""
+Cold start budget of the crp CLI, the same check as the bench "startup" scenario.
+"""
+
+import subprocess
+import sys
+from os.path import abspath, dirname
+from time import perf_counter
+
+import pytest
+
+from crptoolkit.cli import COMMANDS
+
+ROOT = dirname(dirname(abspath(__file__)))
+# Cold start budget for one `crp <command> --help` process, interpreter start included
+STARTUP_BUDGET = 0.15
+# Parsing a command line must not import these, the command's implementation pulls them in when it runs
+STARTUP_LAZY = ["pymysql", "prettytable", "configparser", "getpass"]
+
+@pytest.mark.parametrize("command", [[]] + [[name] for name in COMMANDS], ids=lambda command: " ".join(["crp", *command]))
+def test_help_starts_cold_within_budget(command):
+    # Best of three, the first run may also pay for writing the bytecode cache
+    timings = []
+    for _ in range(3):
+        start = perf_counter()
+        process = subprocess.run([sys.executable, "-X", "importtime", "-m", "crptoolkit.cli", *command, "--help"], cwd=ROOT, capture_output=True, text=True)
+        timings.append(perf_counter() - start)
+        assert process.returncode == 0, process.stderr
+    imported = {line.rsplit("|", 1)[-1].strip() for line in process.stderr.splitlines()}
+    assert not [module for module in STARTUP_LAZY if module in imported]
+    assert min(timings) <= STARTUP_BUDGET